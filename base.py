@@ -1,18 +1,37 @@
+import cProfile
+import hashlib
+import heapq
+import html
+import itertools
 import json
 import os
+import pstats
+import queue
 import re
+import sqlite3
 import sys
 import threading
 import time
 import traceback
+import tracemalloc
+from collections import Counter, deque
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
 from datetime import datetime, timezone
 from decimal import Decimal
+from email.utils import parsedate_to_datetime
 from urllib.parse import parse_qs, unquote, urlparse, urlsplit, urlunparse
 
 import cloudscraper
 import requests
 import rookiepy
 from bs4 import BeautifulSoup as bs
+from bs4 import SoupStrainer
+from requests.adapters import HTTPAdapter
 
 from colors import fb, fc, fg, flb, flg, fm, fr, fy
 
@@ -38,6 +57,247 @@ LINKS = {
 
 scrapper_timeout_period = 10  # seconds
 scrapper_max_retries = 5  # retries
+scraper_retry_delay = 0.5  # seconds before retrying a server error, doubled each time
+scraper_max_workers = 24  # fetch workers shared by all sites
+scraper_per_host_limit = 4  # concurrent requests per host
+scraper_pool_maxsize = 4  # keep-alive connections kept per host
+scraper_queue_size = 50  # scraped courses waiting to be enrolled
+scraper_parse_processes = 0  # 0 parses in the scraping threads
+scraper_metrics_dir = "Metrics"
+
+http_cache_dir = "Cache/http"
+http_cache_max_bytes = 200 * 1024 * 1024  # 200 MB
+http_cache_ttl = {  # seconds a cached page is used without asking the site
+    "www.discudemy.com": 30 * 60,
+    "www.udemyfreebies.com": 30 * 60,
+    "www.tutorialbar.com": 60 * 60,
+    "coursevania.com": 60 * 60,
+    "idownloadcoupon.com": 30 * 60,
+    "jobs.e-next.in": 60 * 60,
+    "www.coursejoiner.com": 60 * 60,
+    "www.cursosdev.com": 60 * 60,
+}
+try:
+    import lxml  # noqa: F401
+
+    html_parser = "lxml"
+except ImportError:
+    html_parser = "html5lib"
+
+# Only the elements each site reads are built when parsing its pages
+page_strainers = {
+    "du": {
+        "listing": SoupStrainer("a", class_="card-header"),
+        "detail": SoupStrainer("div", class_="ui segment"),
+    },
+    "uf": {
+        "listing": SoupStrainer("a", class_="theme-img"),
+    },
+    "tb": {
+        "listing": SoupStrainer(
+            "h2", class_="mb15 mt0 font110 mobfont100 fontnormal lineheight20"
+        ),
+        "detail": SoupStrainer("a", class_="btn_offer_block re_track_btn"),
+    },
+    "cv": {
+        "listing": SoupStrainer("div", class_="stm_lms_courses__single--title"),
+        "detail": SoupStrainer("a", class_="masterstudy-button-affiliate__link"),
+    },
+    "idc": {
+        "listing": SoupStrainer(
+            "a", class_="woocommerce-LoopProduct-link woocommerce-loop-product__link"
+        ),
+    },
+    "en": {
+        "listing": SoupStrainer("a", class_="btn btn-secondary btn-sm btn-block"),
+        "detail": SoupStrainer(["h3", "a"]),
+    },
+    "cj": {
+        "listing": SoupStrainer("h2", class_="card-title entry-title"),
+        "detail": SoupStrainer(
+            "a",
+            class_="wp-block-button__link has-black-color has-luminous-vivid-amber-to-luminous-vivid-orange-gradient-background has-text-color has-background wp-element-button",
+        ),
+        "redirect": SoupStrainer("span", id="url"),
+    },
+    "cd": {
+        "listing": SoupStrainer(
+            "a",
+            class_="c-card block bg-white shadow-md hover:shadow-xl rounded-lg overflow-hidden",
+        ),
+        "detail": SoupStrainer("a"),
+    },
+}
+
+
+def tag_string(tag) -> str | None:
+    return None if tag.string is None else str(tag.string)
+
+
+# Pull the compact values each site needs out of a parsed page. Results are
+# plain str/tuple/list so they can come back from a worker process.
+page_extractors = {
+    "du": {
+        "listing": lambda soup: [
+            (
+                f"https://www.discudemy.com/go/{item['href'].split('/')[-1]}",
+                tag_string(item),
+            )
+            for item in soup.find_all("a", {"class": "card-header"})
+        ],
+        "detail": lambda soup: soup.find("div", {"class": "ui segment"}).a["href"],
+    },
+    "uf": {
+        "listing": lambda soup: [
+            (
+                f"https://www.udemyfreebies.com/out/{item['href'].split('/')[4]}",
+                item.img["alt"],
+            )
+            for item in soup.find_all("a", {"class": "theme-img"})
+        ],
+    },
+    "tb": {
+        "listing": lambda soup: [
+            (item.a["href"], tag_string(item.a))
+            for item in soup.find_all(
+                "h2", class_="mb15 mt0 font110 mobfont100 fontnormal lineheight20"
+            )
+        ],
+        "detail": lambda soup: soup.find("a", class_="btn_offer_block re_track_btn")[
+            "href"
+        ],
+    },
+    "cv": {
+        "listing": lambda soup: [
+            (item.a["href"], tag_string(item.h5))
+            for item in soup.find_all(
+                "div", {"class": "stm_lms_courses__single--title"}
+            )
+        ],
+        "detail": lambda soup: soup.find(
+            "a",
+            {"class": "masterstudy-button-affiliate__link"},
+        )["href"],
+    },
+    "idc": {
+        "listing": lambda soup: [
+            (
+                f"https://idownloadcoupon.com/udemy/{item['href'].split('/')[4]}/",
+                tag_string(item.h2),
+            )
+            for item in soup.find_all(
+                "a",
+                attrs={
+                    "class": "woocommerce-LoopProduct-link woocommerce-loop-product__link"
+                },
+            )
+            if item["href"].split("/")[4] != "85"
+        ],
+    },
+    "en": {
+        "listing": lambda soup: [
+            (item["href"], None)
+            for item in soup.find_all(
+                "a", {"class": "btn btn-secondary btn-sm btn-block"}
+            )
+        ],
+        "detail": lambda soup: (
+            soup.find("h3").string.strip(),
+            soup.find("a", {"class": "btn btn-primary"})["href"],
+        ),
+    },
+    "cj": {
+        "listing": lambda soup: [
+            (item.a["href"], tag_string(item.a))
+            for item in soup.find_all("h2", class_="card-title entry-title")
+        ],
+        "detail": lambda soup: soup.find(
+            "a",
+            class_="wp-block-button__link has-black-color has-luminous-vivid-amber-to-luminous-vivid-orange-gradient-background has-text-color has-background wp-element-button",
+        )["href"],
+        "redirect": lambda soup: soup.find("span", id="url").get_text(),
+    },
+    "cd": {
+        "listing": lambda soup: [
+            (item["href"], None)
+            for item in soup.find_all(
+                "a",
+                class_="c-card block bg-white shadow-md hover:shadow-xl rounded-lg overflow-hidden",
+            )
+            if "cursosdev.com" in item["href"]
+        ],
+        "detail": lambda soup: (
+            soup.find(
+                "a", class_="text-4xl text-gray-700 font-bold hover:underline"
+            ).string.strip(),
+            soup.find(
+                "a",
+                class_="border border-purple-800 bg-indigo-900 hover:bg-indigo-500 my-8 mr-2 text-white block rounded-sm font-bold py-4 px-6 ml-2 flex text-center items-center",
+            )["href"],
+        ),
+    },
+}
+
+
+def extract_page(site_code: str, kind: str, content, parser: str = html_parser):
+    """Parses a page and extracts what the site needs from it
+
+    Kept at module level so it can run in a worker process: raw page in,
+    compact values out.
+
+    Returns:
+        tuple: (extracted value, CPU seconds spent)
+    """
+    started = time.thread_time()
+    # html5lib always builds the whole tree and warns about parse_only
+    parse_only = None if parser == "html5lib" else page_strainers[site_code][kind]
+    soup = bs(content, parser, parse_only=parse_only)
+    return page_extractors[site_code][kind](soup), time.thread_time() - started
+
+
+link_store_path = "Cache/links.json"
+link_store_ttl = 3 * 24 * 60 * 60  # 3 days
+listing_seen_path = "Cache/listings.json"
+listing_seen_ttl = 7 * 24 * 60 * 60  # 7 days
+listing_wave = 2  # listing pages fetched at once while looking for seen items
+listing_catch_up = 3  # windows a site may page through after a busy spell
+course_cache_path = "Cache/courses.json"
+course_cache_ttl = 7 * 24 * 60 * 60  # 7 days
+enrolled_snapshot_path = "Cache/enrolled-{user}.json"
+enrolled_sync_workers = 8  # parallel page requests on a full sync
+ledger_path = "Courses/ledger.db"
+ledger_batch_size = 50  # rows written per transaction at most
+ledger_batch_wait = 1.0  # seconds a row may wait for others to share its commit
+seen_links_path = "Cache/seen.json"
+# How long an outcome for a (course, coupon) is trusted before it is checked again
+seen_outcome_ttl = {
+    "enrolled": 90 * 24 * 60 * 60,
+    "already_enrolled": 90 * 24 * 60 * 60,
+    "expired": 30 * 24 * 60 * 60,  # coupons don't come back
+    "excluded": 30 * 24 * 60 * 60,  # only while the filters stay the same
+    "invalid": 24 * 60 * 60,
+}
+enroll_validate_workers = 6  # courses checked at once ahead of checkout
+enroll_validate_ahead = 12  # checked courses waiting for their checkout
+enroll_check_retries = 5  # failed attempts to check a course before giving up
+checkout_cart_size = 5  # courses submitted in one checkout, 1 disables the cart
+checkout_rate_path = "Cache/checkout-rate.json"
+checkout_interval = 3.8  # seconds between checkouts before anything is learned
+checkout_min_interval = 1.0
+checkout_max_interval = 120.0
+checkout_burst = 3  # checkouts that may go out back to back
+checkout_throttle_wait = 60  # when a throttle message has no wait time in it
+checkout_retries = 5  # throttled attempts at one checkout before giving up
+# Error details that mean "slow down", any other detail is a failed checkout
+checkout_throttle_words = re.compile(r"throttl|too many|rate limit", re.IGNORECASE)
+profile_dir = "Profiles"
+profile_top = 40  # functions and allocation sites listed in each report
+profile_sample_interval = 0.005  # seconds between stack samples on Python 3.12+
+# Profiled threads are grouped into phases by the start of their name
+profile_phases = {
+    "scrape": ("scrape",),
+    "enroll": ("MainThread", "enroll-check", "ledger"),
+}
 
 
 class LoginException(Exception):
@@ -50,6 +310,12 @@ class LoginException(Exception):
     pass
 
 
+class ScrapeCancelled(Exception):
+    """The stream a scrape was feeding was cancelled, see CourseStream"""
+
+    pass
+
+
 class RaisingThread(threading.Thread):
     def run(self):
         self._exc = None
@@ -70,6 +336,438 @@ def resource_path(relative_path):
     return os.path.join(os.path.abspath("."), relative_path)
 
 
+def json_value(blob: str, key: str, start: int = 0):
+    """Decodes only the value of the first `key` found in a JSON blob
+
+    Returns:
+        tuple: (value, index just past the key)
+    Raises:
+        KeyError: key not found after start
+    """
+    match = re.compile(rf'"{re.escape(key)}"\s*:\s*').search(blob, start)
+    if not match:
+        raise KeyError(key)
+    return json.JSONDecoder().raw_decode(blob, match.end())[0], match.end()
+
+
+def iso_timestamp(value) -> float | None:
+    """Epoch seconds of an ISO 8601 date, None if it isn't one"""
+    try:
+        moment = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+class FetchScheduler:
+    """Worker pool shared by every scraper site
+
+    Tasks are queued with the host they hit. A worker takes the oldest task
+    whose host is below `per_host_limit`, so a slow site never holds up the
+    others and idle workers keep pulling work from whichever site has some.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = scraper_max_workers,
+        per_host_limit: int = scraper_per_host_limit,
+    ):
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.tasks = deque()
+        self.active_hosts = {}
+        self.workers = []
+        self.idle_workers = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def submit(self, host: str, fn, *args, **kwargs) -> Future:
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("FetchScheduler is shut down")
+            self.tasks.append((host, future, fn, args, kwargs))
+            # Idle workers only cover as many queued tasks as there are of them
+            if (
+                len(self.tasks) > self.idle_workers
+                and len(self.workers) < self.max_workers
+            ):
+                worker = threading.Thread(
+                    target=self.work,
+                    name=f"scrape-worker-{len(self.workers)}",
+                    daemon=True,
+                )
+                self.workers.append(worker)
+                worker.start()
+            self.condition.notify()
+        return future
+
+    def next_task(self):
+        for index, task in enumerate(self.tasks):
+            if self.active_hosts.get(task[0], 0) < self.per_host_limit:
+                del self.tasks[index]
+                return task
+        return None
+
+    def work(self):
+        while True:
+            with self.condition:
+                task = self.next_task()
+                while task is None:
+                    if self.closed:
+                        return
+                    self.idle_workers += 1
+                    self.condition.wait()
+                    self.idle_workers -= 1
+                    task = self.next_task()
+                host, future, fn, args, kwargs = task
+                self.active_hosts[host] = self.active_hosts.get(host, 0) + 1
+
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+
+            with self.condition:
+                self.active_hosts[host] -= 1
+                # A slot for this host is free again, wake anyone skipping it
+                self.condition.notify_all()
+
+    def shutdown(self):
+        with self.condition:
+            self.closed = True
+            for _, future, *_ in self.tasks:
+                future.cancel()
+            self.tasks.clear()
+            self.condition.notify_all()
+
+
+class SessionPool:
+    """Keep-alive sessions for scraping, one per host
+
+    Every scraper request goes through here so TCP/TLS connections are reused
+    across listing pages, detail pages and redirects instead of paying a new
+    handshake for each request. adapter_factory builds the transport adapter
+    of each session, the benchmarks swap it to record or replay traffic.
+    """
+
+    def __init__(
+        self,
+        pool_maxsize: int = scraper_pool_maxsize,
+        on_response=None,
+        adapter_factory=HTTPAdapter,
+    ):
+        self.pool_maxsize = pool_maxsize
+        self.on_response = on_response
+        self.adapter_factory = adapter_factory
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def session(self, url: str) -> requests.Session:
+        host = urlparse(url).netloc
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = self.adapter_factory(
+                    pool_connections=10, pool_maxsize=self.pool_maxsize
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                if self.on_response:
+                    session.hooks["response"].append(self.on_response)
+                self.sessions[host] = session
+        return session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.session(url).get(url, **kwargs)
+
+    def report(self) -> dict:
+        """Connection reuse per session host
+
+        Returns:
+            dict: {host: {"requests": int, "connections": int, "reused": int}}
+        """
+        report = {}
+        with self.lock:
+            sessions = list(self.sessions.items())
+        for host, session in sessions:
+            sent, opened = 0, 0
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools[key]
+                    sent += pool.num_requests
+                    opened += pool.num_connections
+            report[host] = {
+                "requests": sent,
+                "connections": opened,
+                "reused": sent - opened,
+            }
+        return report
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+
+
+class JsonStore:
+    """Persistent key/value store with expiry
+
+    Entries live in memory and are written to `path` as JSON by `save()`.
+    Entries older than `ttl` seconds are treated as missing.
+    """
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.data: dict = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.data = {}
+        self.expire()
+
+    def expire(self):
+        oldest = time.time() - self.ttl
+        with self.lock:
+            self.data = {k: v for k, v in self.data.items() if v[1] > oldest}
+
+    def __contains__(self, key: str) -> bool:
+        entry = self.data.get(key)
+        return entry is not None and entry[1] > time.time() - self.ttl
+
+    def get(self, key: str, default=None):
+        if key not in self:
+            return default
+        return self.data[key][0]
+
+    def stored_at(self, key: str) -> float | None:
+        entry = self.data.get(key)
+        return entry and entry[1]
+
+    def set(self, key: str, value):
+        with self.lock:
+            self.data[key] = [value, time.time()]
+
+    def save(self):
+        self.expire()
+        with self.lock:
+            data = json.dumps(self.data)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as f:
+            f.write(data)
+
+
+class HttpCache:
+    """On-disk cache for scraped pages
+
+    Bodies are stored in `path` with an index holding their ETag and
+    Last-Modified. A page younger than its host's TTL is served from disk,
+    an older one is revalidated with a conditional request so an unchanged
+    page only costs a 304. The least recently used pages are evicted once
+    the cache grows past `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        path: str = http_cache_dir,
+        max_bytes: int = http_cache_max_bytes,
+        ttl: dict = http_cache_ttl,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        try:
+            with open(os.path.join(path, "index.json")) as f:
+                self.index: dict = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.index = {}
+        self.size = sum(entry["size"] for entry in self.index.values())
+
+    def body_path(self, key: str) -> str:
+        return os.path.join(self.path, key)
+
+    def read_body(self, key: str) -> bytes | None:
+        try:
+            with open(self.body_path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            with self.lock:
+                entry = self.index.pop(key, None)
+                if entry:
+                    self.size -= entry["size"]
+            return None
+
+    def lookup(self, url: str) -> tuple[bytes | None, dict]:
+        """Looks up a cached page
+
+        Returns:
+            tuple: (body, {}) if the page is fresh, otherwise (None, headers)
+            where headers are the conditional headers to send, if any
+        """
+        key = hashlib.sha1(url.encode()).hexdigest()
+        with self.lock:
+            entry = self.index.get(key)
+        if not entry:
+            return None, {}
+        now = time.time()
+        if now - entry["stored"] < self.ttl.get(urlparse(url).netloc, 0):
+            body = self.read_body(key)
+            if body is not None:
+                entry["accessed"] = now
+                return body, {}
+        headers = {}
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return None, headers
+
+    def update(self, url: str, r: requests.Response) -> bytes | None:
+        """Stores a fetched page, or refreshes it on a 304
+
+        Returns:
+            bytes: The page content, None if a 304 has nothing left to refresh
+        """
+        key = hashlib.sha1(url.encode()).hexdigest()
+        now = time.time()
+        if r.status_code == 304:
+            body = self.read_body(key)
+            if body is not None:
+                with self.lock:
+                    if key in self.index:
+                        self.index[key].update(stored=now, accessed=now)
+                return body
+            # Body went missing from disk, caller has to fetch it again
+            return None
+        content = r.content
+        cacheable = (
+            r.headers.get("ETag")
+            or r.headers.get("Last-Modified")
+            or self.ttl.get(urlparse(url).netloc)
+        )
+        if r.status_code != 200 or not cacheable:
+            return content
+
+        tmp_path = f"{self.body_path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, self.body_path(key))
+        with self.lock:
+            old = self.index.get(key)
+            if old:
+                self.size -= old["size"]
+            self.index[key] = {
+                "url": url,
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+                "stored": now,
+                "accessed": now,
+                "size": len(content),
+            }
+            self.size += len(content)
+            if self.size > self.max_bytes:
+                self.evict()
+        return content
+
+    def evict(self):
+        """Drops least recently used pages until the cache fits. Lock held"""
+        for key, entry in sorted(self.index.items(), key=lambda i: i[1]["accessed"]):
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(self.body_path(key))
+            except FileNotFoundError:
+                pass
+            del self.index[key]
+            self.size -= entry["size"]
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(self.index)
+        with open(os.path.join(self.path, "index.json"), "w") as f:
+            f.write(data)
+
+
+class SiteMetrics:
+    """What one site's scrape cost and what it yielded
+
+    Phases are wall seconds, parse_time is CPU seconds spent parsing, bytes
+    are decoded response bodies. pages is the number of listing pages
+    fetched, items the number of listing items,
+    filtered how many of them the course filter dropped and links the Udemy
+    links the rest resolved to.
+    """
+
+    fields = (
+        "requests",
+        "bytes",
+        "cache_hits",
+        "not_modified",
+        "stored_links",
+        "retries",
+        "timeouts",
+        "parse_time",
+        "pages",
+        "items",
+        "filtered",
+        "links",
+    )
+
+    def __init__(self):
+        self.phases = {}
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        for field in self.fields:
+            setattr(self, field, 0)
+
+    def add(self, **counts):
+        with self.lock:
+            for field, value in counts.items():
+                setattr(self, field, getattr(self, field) + value)
+
+    def mark(self, phase: str, since: float = None) -> float:
+        """Records the wall time of a phase that ends now"""
+        now = time.perf_counter()
+        self.phases[phase] = round(now - (since or self.started), 3)
+        return now
+
+    def as_dict(self) -> dict:
+        metrics = {field: getattr(self, field) for field in self.fields}
+        metrics["parse_time"] = round(self.parse_time, 3)
+        metrics["phases"] = self.phases
+        return metrics
+
+
+class CourseStream(queue.Queue):
+    """Courses handed over by one background scrape, see
+    Scraper.stream_courses()"""
+
+    def __init__(self, maxsize: int = 0):
+        super().__init__(maxsize)
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+
+    def cancel(self):
+        """Stops the scrape feeding this stream and waits for it to end"""
+        self.cancelled.set()
+        while not self.done.is_set():
+            # Frees scrapers waiting on a full queue
+            try:
+                self.get(timeout=0.2)
+            except queue.Empty:
+                pass
+
+
 class Scraper:
     """
     Scrapers: RD,TB, CV, IDC, EN, DU, UF, CJ
@@ -79,9 +777,44 @@ class Scraper:
         self,
         site_to_scrape: list = list(scraper_dict.keys()),
         debug: bool = False,
+        max_workers: int = scraper_max_workers,
+        per_host_limit: int = scraper_per_host_limit,
+        pool_maxsize: int = scraper_pool_maxsize,
+        use_cache: bool = True,
+        parser: str = html_parser,
+        parse_processes: int = scraper_parse_processes,
+        course_filter=None,
     ):
+        """
+        Args:
+            course_filter (callable, optional): course_filter(title, **meta)
+                returning why a course is excluded, or None. Excluded
+                listing items are dropped before their links are resolved.
+                See ExclusionFilter.listing_rule().
+        """
         self.sites = site_to_scrape
         self.debug = debug
+        self.parser = parser
+        self.course_filter = course_filter
+        # Parsing is CPU bound, worker processes let the sites parse in parallel
+        self.parse_pool = (
+            ProcessPoolExecutor(parse_processes) if parse_processes > 0 else None
+        )
+        self.scheduler = FetchScheduler(max_workers, per_host_limit)
+        self.sessions = SessionPool(pool_maxsize, on_response=self.count_response)
+        self.http_cache = HttpCache() if use_cache else None
+        self.links = JsonStore(link_store_path, link_store_ttl) if use_cache else None
+        self.listings = (
+            JsonStore(listing_seen_path, listing_seen_ttl) if use_cache else None
+        )
+        self.progress_lock = threading.Lock()
+        self.listener = None
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """Clears what the last scrape found, keeping sessions and caches warm"""
+        self.metrics = {scraper_dict[site]: SiteMetrics() for site in self.sites}
         for site in self.sites:
             code_name = scraper_dict[site]
             setattr(self, f"{code_name}_length", 0)
@@ -89,52 +822,382 @@ class Scraper:
             setattr(self, f"{code_name}_done", False)
             setattr(self, f"{code_name}_progress", 0)
             setattr(self, f"{code_name}_error", "")
+        # Listing items shown this run, remembered once they are enrolled
+        self.unlisted = {}
+
+    def emit(self, event: str, site_code: str, value=None):
+        """Reports scraping progress to the listener
 
-    def get_scraped_courses(self, target: object) -> list:
+        Events: "started", "length" (item count), "progress" (items done),
+        "error" (traceback or reason) and "finished" (links found).
+        """
+        if self.listener:
+            site = next(k for k, v in scraper_dict.items() if v == site_code)
+            self.listener(event, site, value)
+
+    def run_site(self, site: str, course_queue: CourseStream = None):
+        code_name = scraper_dict[site]
+        self.local.site = code_name
+        self.local.course_queue = course_queue
+        self.metrics[code_name] = SiteMetrics()
+        self.emit("started", code_name)
+        getattr(self, code_name)()
+        metrics = self.metrics[code_name]
+        metrics.mark("total")
+        metrics.add(links=len(getattr(self, f"{code_name}_data")))
+        if not getattr(self, f"{code_name}_error"):
+            self.emit("finished", code_name, len(getattr(self, f"{code_name}_data")))
+
+    def get_scraped_courses(
+        self, listener=None, course_queue: CourseStream = None
+    ) -> list:
+        """Scrapes every site, each in its own thread
+
+        Args:
+            listener (callable, optional): listener(event, site, value),
+                called from the scraping threads as described in emit()
+            course_queue (CourseStream, optional): Also hands the courses
+                over here, then None once every site is done
+        """
+        self.listener = listener
         threads = []
         scraped_data = {}
-        for site in self.sites:
-            t = threading.Thread(
-                target=target,
-                args=(site,),
-                daemon=True,
-            )
-            t.start()
-            threads.append(t)
-            time.sleep(0.5)
-        for t in threads:
-            t.join()
-        for site in self.sites:
-            scraped_data[site] = getattr(self, f"{scraper_dict[site]}_data")
+        try:
+            for site in self.sites:
+                t = threading.Thread(
+                    target=self.run_site,
+                    args=(site, course_queue),
+                    name=f"scrape-{scraper_dict[site]}",
+                    daemon=True,
+                )
+                t.start()
+                threads.append(t)
+            for t in threads:
+                t.join()
+            for site in self.sites:
+                scraped_data[site] = getattr(self, f"{scraper_dict[site]}_data")
+            if self.http_cache:
+                self.http_cache.save()
+                self.links.save()
+            self.save_metrics()
+            if self.debug:
+                for host, stats in self.sessions.report().items():
+                    print(host, stats)
+        finally:
+            if course_queue is not None:
+                course_queue.put(None)
+                course_queue.done.set()
         return scraped_data
 
-    def append_to_list(self, target: list, title: str, link: str):
-        target.append((title, link))
+    def metric(self, **counts):
+        """Adds counts to the metrics of the site the current thread works for"""
+        metrics = self.metrics.get(getattr(self.local, "site", None))
+        if metrics:
+            metrics.add(**counts)
+
+    def count_response(self, r: requests.Response, *args, **kwargs):
+        self.metric(requests=1, bytes=len(r.content))
+
+    def save_metrics(self) -> str:
+        """Dumps this run's per-site metrics as JSON
+
+        Returns:
+            str: Path of the written file
+        """
+        report = {
+            "sites": {
+                site: self.metrics[scraper_dict[site]].as_dict() for site in self.sites
+            },
+            "connections": self.sessions.report(),
+        }
+        os.makedirs(scraper_metrics_dir, exist_ok=True)
+        path = os.path.join(
+            scraper_metrics_dir, f"{time.strftime('%Y-%m-%d--%H-%M')}.json"
+        )
+        with open(path, "w") as f:
+            json.dump(report, f, indent=4)
+        return path
+
+    def stream_courses(
+        self, listener=None, maxsize: int = scraper_queue_size
+    ) -> CourseStream:
+        """Scrapes in the background, handing courses over as they are found
+
+        Returns:
+            CourseStream: (site, title, link, meta) tuples, then None once
+            every site is done. meta holds what is known about the coupon,
+            see append_to_list(). The queue is bounded, so scrapers wait
+            while the consumer is busy enrolling. A consumer that gives up
+            early calls its cancel() before scraping again.
+        """
+        course_queue = CourseStream(maxsize)
+        threading.Thread(
+            target=self.get_scraped_courses,
+            args=(listener, course_queue),
+            name="scrape",
+            daemon=True,
+        ).start()
+        return course_queue
+
+    def is_filtered(self, title: str | None, **meta) -> bool:
+        if not self.course_filter or not title:
+            return False
+        rule = self.course_filter(title, **meta)
+        if rule:
+            self.metric(filtered=1)
+            if self.debug:
+                print("Filtered:", rule, title)
+        return bool(rule)
+
+    def append_to_list(
+        self,
+        site_code: str,
+        title: str,
+        link: str,
+        first_seen: float = None,
+        expires: float = None,
+    ):
+        """Adds a scraped course
+
+        Args:
+            first_seen (float, optional): When the coupon was first listed
+            expires (float, optional): When the coupon expires, if known
+        """
+        if self.is_cancelled():
+            return
+        getattr(self, f"{site_code}_data").append((title, link))
+        course_queue = getattr(self.local, "course_queue", None)
+        if course_queue is not None:
+            site = next(k for k, v in scraper_dict.items() if v == site_code)
+            meta = {"first_seen": first_seen or time.time(), "expires": expires}
+            course_queue.put((site, title, link, meta))
+
+    def is_cancelled(self) -> bool:
+        """Whether the stream the current thread scrapes for was cancelled"""
+        course_queue = getattr(self.local, "course_queue", None)
+        return course_queue is not None and course_queue.cancelled.is_set()
+
+    def submit(self, url: str, fn, *args) -> Future:
+        """Schedules fn on the fetch pool, attributed to the current site"""
+        site_code = getattr(self.local, "site", None)
+        course_queue = getattr(self.local, "course_queue", None)
+
+        def task():
+            self.local.site = site_code
+            self.local.course_queue = course_queue
+            return fn(*args)
+
+        return self.scheduler.submit(urlparse(url).netloc, task)
+
+    def fetch_pages(self, urls: list, headers: dict = None) -> list:
+        """Fetches all urls through the scheduler, keeping their order"""
+        futures = [
+            self.submit(url, self.fetch_page_content, url, headers) for url in urls
+        ]
+        return [future.result() for future in futures]
+
+    def fetch_listing(
+        self, site_code: str, page_url: str, pages: int, headers: dict = None
+    ) -> list:
+        """Fetches a site's listing pages, newest first, and returns their entries
+
+        With no record of earlier runs the first `pages` pages are fetched.
+        Otherwise pages come listing_wave at a time and paging stops at the
+        first page whose items were all listed on earlier runs, so a quiet
+        site costs a page or two. A site that posted more than `pages` pages
+        since is followed further, up to listing_catch_up times as far.
+
+        Args:
+            page_url (str): Listing page URL with a {page} placeholder
+            pages (int): Pages fetched when nothing is known about the site
+        """
+        listed = (self.listings and self.listings.get(site_code)) or {}
+        last_page = pages * listing_catch_up if listed else pages
+        wave = listing_wave if listed else pages
+        entries = []
+        page = 1
+        while page <= last_page:
+            numbers = range(page, min(page + wave, last_page + 1))
+            contents = self.fetch_pages(
+                [page_url.format(page=number) for number in numbers], headers
+            )
+            self.metric(pages=len(contents))
+            for content in contents:
+                items = self.extract(site_code, "listing", content)
+                entries.extend(items)
+                # An empty page is past the end of the listing
+                if listed and all(url in listed for url, _ in items):
+                    return entries
+            page += len(numbers)
+        return entries
+
+    def mark_listed(self):
+        """Remembers the listing items the sites showed this run
+
+        Call it once the scraped courses were enrolled, otherwise the next
+        run stops paging before the items that were never handled.
+        """
+        if self.listings is None:
+            return
+        now = time.time()
+        oldest = now - listing_seen_ttl
+        for site_code, entries in self.unlisted.items():
+            listed = {
+                url: at
+                for url, at in (self.listings.get(site_code) or {}).items()
+                if at > oldest
+            }
+            listed.update(dict.fromkeys((url for url, _ in entries), now))
+            self.listings.set(site_code, listed)
+        self.unlisted = {}
+        self.listings.save()
+
+    def resolve_items(self, site_code: str, entries: list, resolve):
+        """Resolves listing entries to Udemy links concurrently
+
+        Args:
+            site_code (str): Site code, e.g. "du"
+            entries (list): (url, title) pairs taken from the listing pages
+            resolve (callable): resolve(url, title) -> (title, link) or None
+        """
+        metrics = self.metrics.get(site_code) or SiteMetrics()
+        listed = metrics.mark("listing")
+        metrics.add(items=len(entries))
+        listing = entries
+        # Titles known from the listing are filtered before any detail page
+        entries = [
+            (url, title) for url, title in entries if not self.is_filtered(title)
+        ]
+        self.set_length(site_code, len(entries))
+
+        def resolve_and_store(url, title):
+            result = resolve(url, title)
+            self.links.set(url, result and list(result))
+            return result
+
+        futures = {}
+        for url, title in entries:
+            # Items resolved on an earlier run skip the network entirely
+            if self.links and url in self.links:
+                result = self.links.get(url)
+                future = Future()
+                future.set_result(result and tuple(result))
+                metrics.add(stored_links=1)
+            elif self.links:
+                future = self.submit(url, resolve_and_store, url, title)
+            else:
+                future = self.submit(url, resolve, url, title)
+            future.add_done_callback(lambda _: self.advance(site_code))
+            futures[future] = url
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                # Some listings have no titles, those are filtered here
+                if result and not self.is_filtered(result[0]):
+                    title, link = result
+                    if self.debug:
+                        print(title, link)
+                    # Resolved on an earlier run means listed since then
+                    first_seen = self.links and self.links.stored_at(futures[future])
+                    self.append_to_list(site_code, title, link, first_seen)
+            # Only once all of them were handed over, see mark_listed()
+            self.unlisted.setdefault(site_code, []).extend(listing)
+        finally:
+            for future in futures:
+                future.cancel()
+            metrics.mark("detail", listed)
 
     def fetch_page_content(
         self, url: str, headers: dict = None, timeout_retries=scrapper_max_retries
     ) -> bytes:
+        if self.is_cancelled():
+            raise ScrapeCancelled
+        if not self.http_cache:
+            request_headers = headers
+        else:
+            content, conditional = self.http_cache.lookup(url)
+            if content is not None:
+                self.metric(cache_hits=1)
+                return content
+            request_headers = {**(headers or {}), **conditional}
         try:
-            return requests.get(
-                url, headers=headers, timeout=scrapper_timeout_period
-            ).content
+            r = self.sessions.get(
+                url, headers=request_headers, timeout=scrapper_timeout_period
+            )
+            if r.status_code >= 500:
+                # Overloaded or restarting sites usually answer the next try
+                if timeout_retries <= 0:
+                    return None
+                self.metric(retries=1)
+                time.sleep(
+                    scraper_retry_delay * 2 ** (scrapper_max_retries - timeout_retries)
+                )
+                return self.fetch_page_content(
+                    url, headers, timeout_retries=timeout_retries - 1
+                )
+            if not self.http_cache:
+                return r.content
+            if r.status_code == 304:
+                self.metric(not_modified=1)
+            content = self.http_cache.update(url, r)
+            if content is None:
+                return self.fetch_page_content(url, headers, timeout_retries)
+            return content
         except requests.exceptions.Timeout:
+            self.metric(timeouts=1)
             if timeout_retries > 0:
+                self.metric(retries=1)
                 return self.fetch_page_content(
                     url, headers, timeout_retries=timeout_retries - 1
                 )
             else:
                 return None
 
-    def parse_html(self, content: str):
-        return bs(content, "html5lib")
+    def extract(self, site_code: str, kind: str, content):
+        """Parses a page and returns what page_extractors pulls out of it
 
-    def handle_exception(self, site_code: str):
-        setattr(self, f"{site_code}_error", traceback.format_exc())
+        Runs in the parse pool when there is one, the calling thread only
+        waits for the result.
+        """
+        if self.parse_pool:
+            value, parse_time = self.parse_pool.submit(
+                extract_page, site_code, kind, content, self.parser
+            ).result()
+        else:
+            value, parse_time = extract_page(site_code, kind, content, self.parser)
+        self.metric(parse_time=parse_time)
+        return value
+
+    def close(self):
+        self.scheduler.shutdown()
+        if self.parse_pool:
+            self.parse_pool.shutdown(cancel_futures=True)
+        self.sessions.close()
+
+    def advance(self, site_code: str):
+        """Counts one more item of the site as done"""
+        with self.progress_lock:
+            progress = getattr(self, f"{site_code}_progress") + 1
+            setattr(self, f"{site_code}_progress", progress)
+        self.emit("progress", site_code, progress)
+
+    def set_length(self, site_code: str, length: int):
+        setattr(self, f"{site_code}_length", length)
+        if self.debug:
+            print("Length:", length)
+        self.emit("length", site_code, length)
+
+    def handle_exception(self, site_code: str, error: str = None):
+        if isinstance(sys.exc_info()[1], ScrapeCancelled):
+            # Nothing went wrong, the courses are just no longer wanted
+            setattr(self, f"{site_code}_done", True)
+            return
+        setattr(self, f"{site_code}_error", error or traceback.format_exc())
         setattr(self, f"{site_code}_length", -1)
         setattr(self, f"{site_code}_done", True)
         if self.debug:
             print(getattr(self, f"{site_code}_error"))
+        self.emit("error", site_code, getattr(self, f"{site_code}_error"))
 
     def cleanup_link(self, link: str) -> str:
         parsed_url = urlparse(link)
@@ -155,36 +1218,21 @@ class Scraper:
 
     def du(self):
         try:
-            all_items = []
             head = {
                 "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.159 Safari/537.36 Edg/92.0.902.84",
                 "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9",
             }
+            entries = self.fetch_listing(
+                "du", "https://www.discudemy.com/all/{page}", 5, headers=head
+            )
 
-            for page in range(1, 6):
-                # start timer for each page with timeout
-                content = self.fetch_page_content(
-                    f"https://www.discudemy.com/all/{page}", headers=head
-                )
-                soup = self.parse_html(content)
-                page_items = soup.find_all("a", {"class": "card-header"})
-                all_items.extend(page_items)
-            self.du_length = len(all_items)
-            if self.debug:
-                print("Length:", self.du_length)
-            for index, item in enumerate(all_items):
-                self.du_progress = index
-                title = item.string
-                url = item["href"].split("/")[-1]
-                content = self.fetch_page_content(
-                    f"https://www.discudemy.com/go/{url}", headers=head
-                )
-                soup = self.parse_html(content)
-                link = soup.find("div", {"class": "ui segment"}).a["href"]
+            def resolve(url, title):
+                content = self.fetch_page_content(url, headers=head)
+                link = self.extract("du", "detail", content)
                 if link.startswith("https://www.udemy.com") or link.startswith("http://www.udemy.com"):
-                    if self.debug:
-                        print(title, link)
-                    self.append_to_list(self.du_data, title, link)
+                    return title, link
+
+            self.resolve_items("du", entries, resolve)
 
         except:
             self.handle_exception("du")
@@ -194,25 +1242,16 @@ class Scraper:
 
     def uf(self):
         try:
-            all_items = []
-            for page in range(1, 6):
-                content = self.fetch_page_content(
-                    f"https://www.udemyfreebies.com/free-udemy-courses/{page}"
-                )
-                soup = self.parse_html(content)
-                page_items = soup.find_all("a", {"class": "theme-img"})
-                all_items.extend(page_items)
-            self.uf_length = len(all_items)
-            if self.debug:
-                print("Length:", self.uf_length)
-            for index, item in enumerate(all_items):
-                title = item.img["alt"]
-                link = requests.get(
-                    f"https://www.udemyfreebies.com/out/{item['href'].split('/')[4]}"
-                ).url
+            entries = self.fetch_listing(
+                "uf", "https://www.udemyfreebies.com/free-udemy-courses/{page}", 5
+            )
+
+            def resolve(url, title):
+                link = self.sessions.get(url).url
                 if link.startswith("https://www.udemy.com") or link.startswith("http://www.udemy.com"):
-                    self.append_to_list(self.uf_data, title, link)
-                    self.uf_progress = index
+                    return title, link
+
+            self.resolve_items("uf", entries, resolve)
 
         except:
             self.handle_exception("uf")
@@ -222,30 +1261,17 @@ class Scraper:
 
     def tb(self):
         try:
-            all_items = []
-
-            for page in range(1, 8):
-                content = self.fetch_page_content(
-                    f"https://www.tutorialbar.com/all-courses/page/{page}"
-                )
-                soup = self.parse_html(content)
-                page_items = soup.find_all(
-                    "h2", class_="mb15 mt0 font110 mobfont100 fontnormal lineheight20"
-                )
-                all_items.extend(page_items)
-            self.tb_length = len(all_items)
-            if self.debug:
-                print("Length:", self.tb_length)
+            entries = self.fetch_listing(
+                "tb", "https://www.tutorialbar.com/all-courses/page/{page}", 7
+            )
 
-            for index, item in enumerate(all_items):
-                self.tb_progress = index
-                title = item.a.string
-                url = item.a["href"]
+            def resolve(url, title):
                 content = self.fetch_page_content(url)
-                soup = self.parse_html(content)
-                link = soup.find("a", class_="btn_offer_block re_track_btn")["href"]
+                link = self.extract("tb", "detail", content)
                 if "www.udemy.com" in link:
-                    self.append_to_list(self.tb_data, title, link)
+                    return title, link
+
+            self.resolve_items("tb", entries, resolve)
 
         except:
             self.handle_exception("tb")
@@ -264,28 +1290,37 @@ class Scraper:
                 "dnt": "1",
             }
             try:
-                r = requests.get(
+                r = self.sessions.get(
                     "https://cdn.real.discount/api/courses?page=1&limit=500&sortBy=sale_start&store=Udemy&freeOnly=true",
                     headers=headers,
                     timeout=(10, 30),
                 ).json()
             except requests.exceptions.Timeout:
-                self.rd_error = "Timeout"
-                self.rd_length = -1
-                self.rd_done = True
+                self.handle_exception("rd", "Timeout")
                 return
             all_items.extend(r["items"])
 
-            self.rd_length = len(all_items)
-            if self.debug:
-                print("Length:", self.rd_length)
-            for index, item in enumerate(all_items):
-                self.rd_progress = index
+            self.set_length("rd", len(all_items))
+            for item in all_items:
+                self.advance("rd")
                 title: str = item["name"]
                 link: str = item["url"]
                 link = self.cleanup_link(link)
+                if self.is_filtered(
+                    title,
+                    language=item.get("language"),
+                    category=item.get("category"),
+                    rating=item.get("rating"),
+                ):
+                    continue
                 if link and (link.startswith("https://www.udemy.com") or link.startswith("http://www.udemy.com")):
-                    self.append_to_list(self.rd_data, title, link)
+                    self.append_to_list(
+                        "rd",
+                        title,
+                        link,
+                        iso_timestamp(item.get("sale_start")),
+                        iso_timestamp(item.get("sale_end") or item.get("expiry")),
+                    )
 
         except:
             self.handle_exception("rd")
@@ -296,44 +1331,35 @@ class Scraper:
     def cv(self):
         try:
             content = self.fetch_page_content("https://coursevania.com/courses/")
-            soup = self.parse_html(content)
             try:
+                # The nonce sits in an inline script, no need to parse the page
                 nonce = json.loads(
                     re.search(
-                        r"var stm_lms_nonces = ({.*?});", soup.text, re.DOTALL
+                        r"var stm_lms_nonces = ({.*?});",
+                        content.decode("utf-8", "ignore"),
+                        re.DOTALL,
                     ).group(1)
                 )["load_content"]
                 if self.debug:
                     print("Nonce:", nonce)
             except IndexError:
-                self.cv_error = "Nonce not found"
-                self.cv_length = -1
-                self.cv_done = True
+                self.handle_exception("cv", "Nonce not found")
                 return
-            r = requests.get(
+            r = self.sessions.get(
                 "https://coursevania.com/wp-admin/admin-ajax.php?&template=courses/grid&args={%22posts_per_page%22:%2260%22}&action=stm_lms_load_content&nonce="
                 + nonce
                 + "&sort=date_high"
             ).json()
 
-            soup = self.parse_html(r["content"])
-            page_items = soup.find_all(
-                "div", {"class": "stm_lms_courses__single--title"}
-            )
-            self.cv_length = len(page_items)
-            if self.debug:
-                print("Small Length:", self.cv_length)
-            for index, item in enumerate(page_items):
-                self.cv_progress = index
-                title = item.h5.string
-                content = self.fetch_page_content(item.a["href"])
-                soup = self.parse_html(content)
-                link = soup.find(
-                    "a",
-                    {"class": "masterstudy-button-affiliate__link"},
-                )["href"]
+            entries = self.extract("cv", "listing", r["content"])
+
+            def resolve(url, title):
+                content = self.fetch_page_content(url)
+                link = self.extract("cv", "detail", content)
                 if link.startswith("https://www.udemy.com") or link.startswith("http://www.udemy.com"):
-                    self.append_to_list(self.cv_data, title, link)
+                    return title, link
+
+            self.resolve_items("cv", entries, resolve)
 
         except:
             self.handle_exception("cv")
@@ -343,38 +1369,23 @@ class Scraper:
 
     def idc(self):
         try:
-            all_items = []
-            for page in range(1, 8):
-                content = self.fetch_page_content(
-                    f"https://idownloadcoupon.com/product-category/udemy/page/{page}"
-                )
-                soup = self.parse_html(content)
-                page_items = soup.find_all(
-                    "a",
-                    attrs={
-                        "class": "woocommerce-LoopProduct-link woocommerce-loop-product__link"
-                    },
-                )
-                all_items.extend(page_items)
-            self.idc_length = len(all_items)
-            if self.debug:
-                print("Length:", self.idc_length)
-            for index, item in enumerate(all_items):
-                self.idc_progress = index
-                title = item.h2.string
-                link_num = item["href"].split("/")[4]
-                if link_num == "85":
-                    continue
-                link = f"https://idownloadcoupon.com/udemy/{link_num}/"
+            entries = self.fetch_listing(
+                "idc",
+                "https://idownloadcoupon.com/product-category/udemy/page/{page}",
+                7,
+            )
 
-                r = requests.get(
-                    link,
+            def resolve(url, title):
+                r = self.sessions.get(
+                    url,
                     allow_redirects=False,
                 )
                 link = unquote(r.headers["Location"])
                 link = self.cleanup_link(link)
                 if link.startswith("https://www.udemy.com") or link.startswith("http://www.udemy.com"):
-                    self.append_to_list(self.idc_data, title, link)
+                    return title, link
+
+            self.resolve_items("idc", entries, resolve)
 
         except:
             self.handle_exception("idc")
@@ -384,30 +1395,18 @@ class Scraper:
 
     def en(self):
         try:
-            all_items = []
-            for page in range(1, 10):
-                content = self.fetch_page_content(
-                    f"https://jobs.e-next.in/course/udemy/{page}"
-                )
-                soup = self.parse_html(content)
-                page_items = soup.find_all(
-                    "a", {"class": "btn btn-secondary btn-sm btn-block"}
-                )
-                all_items.extend(page_items)
-
-            self.en_length = len(all_items)
+            entries = self.fetch_listing(
+                "en", "https://jobs.e-next.in/course/udemy/{page}", 9
+            )
 
-            if self.debug:
-                print("Length:", self.en_length)
-            for index, item in enumerate(all_items):
-                self.en_progress = index
-                content = self.fetch_page_content(item["href"])
-                soup = self.parse_html(content)
-                title = soup.find("h3").string.strip()
-                link = soup.find("a", {"class": "btn btn-primary"})["href"]
+            def resolve(url, title):
+                content = self.fetch_page_content(url)
+                title, link = self.extract("en", "detail", content)
                 if link.startswith("https://www.udemy.com") or link.startswith("http://www.udemy.com"):
-                    self.append_to_list(self.en_data, title, link)
-            
+                    return title, link
+
+            self.resolve_items("en", entries, resolve)
+
         except:
             self.handle_exception("en")
         self.en_done = True
@@ -417,41 +1416,25 @@ class Scraper:
 
     def cj(self):
         try:
-            all_items = []
-
-            for page in range(1, 2):
-                content = self.fetch_page_content(
-                    f"https://www.coursejoiner.com/category/free-udemy/page/{page}/"
-                )
-                soup = self.parse_html(content)
-                page_items = soup.find_all("h2", class_="card-title entry-title")
-                all_items.extend(page_items)
-            self.cj_length = len(all_items)
-            if self.debug:
-                print("Length:", self.cj_length)
+            entries = self.fetch_listing(
+                "cj", "https://www.coursejoiner.com/category/free-udemy/page/{page}/", 1
+            )
 
-            for index, item in enumerate(all_items):
-                self.cj_progress = index
-                title = item.a.string
-                url = item.a["href"]
+            def resolve(url, title):
                 content = self.fetch_page_content(url)
-                soup = self.parse_html(content)
-                link = soup.find(
-                    "a",
-                    class_="wp-block-button__link has-black-color has-luminous-vivid-amber-to-luminous-vivid-orange-gradient-background has-text-color has-background wp-element-button",
-                )["href"]
-                session = requests.Session()
-                session.strict_redirects = False
+                link = self.extract("cj", "detail", content)
                 while "www.udemy.com" not in link:
-                    link_b = session.get(link, allow_redirects=True).url
+                    link_b = self.sessions.get(link, allow_redirects=True).url
                     # Find url in the response (hidden field)
                     res_c = self.fetch_page_content(link_b)
-                    soup_c = self.parse_html(res_c)
-                    link_c = soup_c.find("span", id="url").get_text()
-                    link = requests.get(link_c, allow_redirects=True).url
-                    
+                    link_c = self.extract("cj", "redirect", res_c)
+                    link = self.sessions.get(link_c, allow_redirects=True).url
+
                 if link.startswith("https://www.udemy.com") or link.startswith("http://www.udemy.com"):
-                    self.append_to_list(self.cj_data, title, link)
+                    return title, link
+
+            self.resolve_items("cj", entries, resolve)
+
         except:
             self.handle_exception("cj")
         self.cj_done = True
@@ -460,43 +1443,19 @@ class Scraper:
 
     def cd(self):
         try:
-            all_items = []
-
-            for page in range(1, 2):
-                content = self.fetch_page_content(
-                    f"https://www.cursosdev.com/?page={page}/"
-                )
-                soup = self.parse_html(content)
-                page_items = soup.find_all(
-                    "a",
-                    class_="c-card block bg-white shadow-md hover:shadow-xl rounded-lg overflow-hidden",
-                )
-
-                all_items.extend(page_items)
-            self.cd_length = len(all_items)
-            if self.debug:
-                print("Length:", self.cd_length)
-
-            for index, item in enumerate(all_items):
-                self.cd_progress = index
+            entries = self.fetch_listing(
+                "cd", "https://www.cursosdev.com/?page={page}/", 1
+            )
 
-                url = item["href"]
-                if "cursosdev.com" not in url:
-                    continue
+            def resolve(url, title):
                 content = self.fetch_page_content(url)
-                soup = self.parse_html(content)
-                title = soup.find(
-                    "a", class_="text-4xl text-gray-700 font-bold hover:underline"
-                ).string.strip()
-                link = soup.find(
-                    "a",
-                    class_="border border-purple-800 bg-indigo-900 hover:bg-indigo-500 my-8 mr-2 text-white block rounded-sm font-bold py-4 px-6 ml-2 flex text-center items-center",
-                )["href"]
-                session = requests.Session()
-                session.strict_redirects = False
-                link = session.get(link, allow_redirects=True).url
+                title, link = self.extract("cd", "detail", content)
+                link = self.sessions.get(link, allow_redirects=True).url
                 if link.startswith("https://www.udemy.com") or link.startswith("http://www.udemy.com"):
-                    self.append_to_list(self.cd_data, title, link)
+                    return title, link
+
+            self.resolve_items("cd", entries, resolve)
+
         except:
             self.handle_exception("cd")
         self.cd_done = True
@@ -504,6 +1463,475 @@ class Scraper:
             print("Return Length:", len(self.cd_data))
 
 
+class CheckoutLimiter:
+    """Token bucket spacing out checkouts
+
+    Tokens refill at one per `interval` seconds. The interval shrinks a
+    little after every checkout that goes through and doubles when Udemy
+    throttles, which also blocks checkouts until the wait it asked for is
+    over. The learned state is saved so the next run carries on from it.
+    """
+
+    def __init__(self, path: str = checkout_rate_path, burst: int = checkout_burst):
+        self.path = path
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.interval = checkout_interval
+        self.resume_at = 0.0
+        self.tokens = float(burst)
+        self.updated = time.time()
+        # This run's totals, not saved
+        self.waited = 0.0
+        self.throttles = 0
+        try:
+            with open(path) as f:
+                state = json.load(f)
+            self.interval = state["interval"]
+            self.resume_at = state["resume_at"]
+            self.tokens = state["tokens"]
+            self.updated = state["updated"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            pass
+
+    def refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) / self.interval
+            )
+            self.updated = now
+
+    def acquire(self, stopping: threading.Event = None) -> float | None:
+        """Blocks until a checkout may be sent
+
+        Args:
+            stopping (threading.Event, optional): Gives up waiting once set
+
+        Returns:
+            float | None: Seconds spent waiting, None if stopped first
+        """
+        stopping = stopping or threading.Event()
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                self.refill(now)
+                wait = self.resume_at - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        self.waited += waited
+                        return waited
+                    wait = (1 - self.tokens) * self.interval
+            if stopping.wait(wait):
+                self.waited += waited
+                return None
+            waited += wait
+
+    def ready(self) -> bool:
+        """Whether acquire() would return without waiting"""
+        with self.lock:
+            now = time.time()
+            self.refill(now)
+            return self.resume_at <= now and self.tokens >= 1
+
+    def throttled(self, wait: float):
+        with self.lock:
+            now = time.time()
+            self.throttles += 1
+            self.resume_at = max(self.resume_at, now + wait)
+            self.interval = min(checkout_max_interval, self.interval * 2)
+            # One retry once the wait is over, then back to the slower pace
+            self.tokens = 1.0
+            self.updated = self.resume_at
+
+    def retry_after(self, headers) -> float | None:
+        """Seconds to wait according to the rate limit headers, if any"""
+        if value := headers.get("Retry-After"):
+            try:
+                return float(value)
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(value)
+                except (TypeError, ValueError):
+                    return None
+                return max(0.0, retry_at.timestamp() - time.time())
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        if remaining == "0" and reset:
+            try:
+                reset = float(reset)
+            except ValueError:
+                return None
+            # Either seconds left or an epoch timestamp
+            return reset - time.time() if reset > time.time() else reset
+        return None
+
+    def update(self, r: requests.Response, body: dict) -> float | None:
+        """Learns from a checkout response
+
+        Only a 429 or a detail worded as a throttle counts as throttled.
+        Other details, such as an expired session, are failed checkouts and
+        leave the pace alone.
+
+        Returns:
+            float | None: Seconds Udemy asked to wait, None if not throttled
+        """
+        wait = self.retry_after(r.headers)
+        detail = str(body.get("detail") or "")
+        if r.status_code != 429 and detail and not checkout_throttle_words.search(
+            detail
+        ):
+            return None
+        if detail:
+            if wait is None:
+                match = re.search(r"\d+", detail)
+                wait = int(match.group(0)) + 1.5 if match else checkout_throttle_wait
+        elif r.status_code != 429:
+            if wait is not None:
+                # Not throttled yet, but the window is used up
+                with self.lock:
+                    self.resume_at = max(self.resume_at, time.time() + wait)
+            with self.lock:
+                self.interval = max(checkout_min_interval, self.interval * 0.9)
+            return None
+        self.throttled(checkout_throttle_wait if wait is None else wait)
+        return self.resume_at - time.time()
+
+    def save(self):
+        with self.lock:
+            state = {
+                "interval": self.interval,
+                "resume_at": self.resume_at,
+                "tokens": self.tokens,
+                "updated": self.updated,
+            }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(state, f)
+
+
+class ExclusionFilter:
+    """The exclusion settings compiled for fast lookups
+
+    Title entries of one word go in a set, longer ones are indexed by their
+    first word, so a title costs one lookup per word whatever the size of
+    the lists. Matching is case-insensitive on whitespace separated words.
+    Every check returns the rule that fired, or None.
+    """
+
+    def __init__(self, settings: dict):
+        self.words = set()
+        self.phrases = {}
+        for entry in settings["title_exclude"]:
+            words = tuple(entry.casefold().split())
+            if len(words) == 1:
+                self.words.add(words[0])
+            elif words:
+                self.phrases.setdefault(words[0], []).append(words)
+        self.instructors = set(settings["instructor_exclude"])
+        self.categories = {k for k, v in settings["categories"].items() if v}
+        self.languages = {k for k, v in settings["languages"].items() if v}
+        self.known_categories = set(settings["categories"])
+        self.known_languages = set(settings["languages"])
+        self.min_rating = settings["min_rating"]
+
+    def title_rule(self, title: str) -> str | None:
+        words = title.casefold().split()
+        for index, word in enumerate(words):
+            if word in self.words:
+                return word
+            for phrase in self.phrases.get(word, ()):
+                if tuple(words[index : index + len(phrase)]) == phrase:
+                    return " ".join(phrase)
+        return None
+
+    def instructor_rule(self, instructors: list) -> str | None:
+        return next((i for i in instructors if i in self.instructors), None)
+
+    def category_rule(self, category: str) -> str | None:
+        return None if category in self.categories else category
+
+    def language_rule(self, language: str) -> str | None:
+        return None if language in self.languages else language
+
+    def rating_rule(self, rating: float) -> str | None:
+        return None if rating >= self.min_rating else f"{rating} < {self.min_rating}"
+
+    def listing_rule(
+        self, title: str, language=None, category=None, rating=None
+    ) -> str | None:
+        """Checks what a coupon site lists about a course
+
+        Metadata is only trusted when it looks like Udemy's own: names we
+        don't know and non-numeric ratings are ignored, the landing page
+        check still catches those courses.
+        """
+        if keyword := self.title_rule(title):
+            return f'Keyword Excluded: "{keyword}"'
+        if language in self.known_languages and self.language_rule(language):
+            return f"Language excluded: {language}"
+        if category in self.known_categories and self.category_rule(category):
+            return f"Category excluded: {category}"
+        if isinstance(rating, (int, float)) and rating > 0:
+            if self.rating_rule(rating):
+                return f"Low rating: {rating}"
+        return None
+
+
+class Ledger:
+    """SQLite record of every course the enroller handled
+
+    Rows are queued by record() and written by a background thread, many
+    to a transaction. The database runs in WAL mode so the analysis
+    scripts can read it while a run is writing. A batch sqlite refuses,
+    say while another run holds the lock, is reported and dropped; the
+    enroller never waits on the ledger.
+    """
+
+    columns = (
+        "run",
+        "processed_at",
+        "site",
+        "title",
+        "link",
+        "course_id",
+        "coupon",
+        "outcome",
+        "amount",  # list price, saved when the outcome is "enrolled"
+        "currency",
+        "check_seconds",
+        "checkout_seconds",
+    )
+
+    def __init__(self, path: str = ledger_path):
+        self.path = path
+        self.rows = queue.Queue()
+        self.ready = threading.Event()
+        self.error = None
+        self.writer = threading.Thread(target=self.write, name="ledger", daemon=True)
+        self.writer.start()
+        self.ready.wait()
+        if self.error:
+            raise self.error
+
+    def connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        db = sqlite3.connect(self.path)
+        db.execute("PRAGMA journal_mode=WAL")
+        # With WAL a crash can only lose the last commits, never corrupt
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS courses (id INTEGER PRIMARY KEY, "
+            "run TEXT, processed_at REAL, site TEXT, title TEXT, link TEXT, "
+            "course_id TEXT, coupon TEXT, outcome TEXT, amount REAL, "
+            "currency TEXT, check_seconds REAL, checkout_seconds REAL)"
+        )
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS courses_outcome ON courses (outcome, course_id)"
+        )
+        db.commit()
+        return db
+
+    def write(self):
+        try:
+            db = self.connect()
+        except sqlite3.Error as e:
+            self.error = e
+            return
+        finally:
+            self.ready.set()
+        insert = (
+            f"INSERT INTO courses ({', '.join(self.columns)}) "
+            f"VALUES ({', '.join('?' * len(self.columns))})"
+        )
+        while True:
+            batch = [self.rows.get()]
+            deadline = time.monotonic() + ledger_batch_wait
+            while batch[-1] is not None and len(batch) < ledger_batch_size:
+                try:
+                    batch.append(
+                        self.rows.get(timeout=max(0, deadline - time.monotonic()))
+                    )
+                except queue.Empty:
+                    break
+            rows = [row for row in batch if row is not None]
+            try:
+                if rows:
+                    with db:
+                        db.executemany(insert, rows)
+            except sqlite3.Error as e:
+                print(f"Ledger: {len(rows)} rows not saved: {e}")
+            finally:
+                for _ in batch:
+                    self.rows.task_done()
+            if batch[-1] is None:
+                db.close()
+                return
+
+    def record(self, **row):
+        row.setdefault("processed_at", time.time())
+        self.rows.put(tuple(row.get(column) for column in self.columns))
+
+    def flush(self):
+        """Blocks until every recorded row is written, or the writer is gone"""
+        with self.rows.all_tasks_done:
+            while self.rows.unfinished_tasks and self.writer.is_alive():
+                self.rows.all_tasks_done.wait(0.5)
+
+    def close(self):
+        self.rows.put(None)
+        self.flush()
+
+
+class RunProfiler:
+    """CPU and memory profile of a run, split into phases
+
+    Every thread started while profiling gets its own cProfile profiler,
+    and their stats are merged per phase by thread name (profile_phases).
+    From Python 3.12 only one cProfile profiler can run at a time, so the
+    phases come from stack samples taken every profile_sample_interval
+    instead, and a combined "run" .prof is written besides. Parse worker
+    processes are not profiled.
+
+    cProfile slowed pure-Python loops 1.4 to 5 times and tracemalloc 4 to
+    11 times (Python 3.11). A run mostly waits on the network and slows
+    far less, but memory tracing stays off unless asked for. tracemalloc
+    cannot tell threads apart, so memory is reported for the whole run:
+    the peak and the allocation sites still holding the most.
+    """
+
+    def __init__(self, path: str = profile_dir, memory: bool = False):
+        self.path = path
+        self.memory = memory
+        self.per_thread = sys.version_info < (3, 12)
+        self.lock = threading.Lock()
+        self.profilers = []
+        # phase -> (own, cumulative) sample counts by function
+        self.samples = {}
+        self.sampling = threading.Event()
+
+    def start(self):
+        if self.memory:
+            tracemalloc.start()
+        if self.per_thread:
+            threading.setprofile(self.profile_thread)
+        else:
+            self.sampling.set()
+            self.sampler = threading.Thread(
+                target=self.sample, name="profile-sampler", daemon=True
+            )
+            self.sampler.start()
+        self.main = self.add_profiler()
+
+    def add_profiler(self) -> cProfile.Profile:
+        profiler = cProfile.Profile()
+        with self.lock:
+            self.profilers.append((threading.current_thread().name, profiler))
+        profiler.enable()
+        return profiler
+
+    def profile_thread(self, frame, event, arg):
+        # First event of a new thread: hand it over to its own profiler
+        sys.setprofile(None)
+        self.add_profiler()
+
+    def sample(self):
+        """Counts the function every thread is in, and those it was called from"""
+        me = threading.get_ident()
+        while self.sampling.is_set():
+            time.sleep(profile_sample_interval)
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                own, cumulative = self.samples.setdefault(
+                    self.phase(names.get(ident, "")), (Counter(), Counter())
+                )
+                own[self.where(frame)] += 1
+                # A recursive function counts once per sample
+                cumulative.update(set(map(self.where, self.stack(frame))))
+
+    @staticmethod
+    def stack(frame):
+        while frame:
+            yield frame
+            frame = frame.f_back
+
+    @staticmethod
+    def where(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+
+    def phase(self, thread_name: str) -> str:
+        for phase, prefixes in profile_phases.items():
+            if thread_name.startswith(prefixes):
+                return phase
+        return "other"
+
+    def stop(self) -> list:
+        """Stops profiling and writes the reports
+
+        Returns:
+            list: Paths of the written reports
+        """
+        threading.setprofile(None)
+        self.main.disable()
+        if self.sampling.is_set():
+            self.sampling.clear()
+            self.sampler.join()
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+        phases = {}
+        with self.lock:
+            profilers = list(self.profilers)
+        for thread_name, profiler in profilers:
+            profiler.create_stats()
+            if not profiler.stats:
+                continue
+            phase = self.phase(thread_name) if self.per_thread else "run"
+            if phase in phases:
+                phases[phase].add(profiler)
+            else:
+                phases[phase] = pstats.Stats(profiler)
+
+        os.makedirs(self.path, exist_ok=True)
+        prefix = os.path.join(self.path, time.strftime("%Y-%m-%d--%H-%M"))
+        paths = []
+        for phase, stats in phases.items():
+            # The .prof file opens in pstats, snakeviz and the like
+            stats.dump_stats(f"{prefix}-{phase}.prof")
+            with open(f"{prefix}-{phase}.txt", "w") as f:
+                stats.stream = f
+                stats.sort_stats("cumulative").print_stats(profile_top)
+            paths.append(f"{prefix}-{phase}.txt")
+        for phase, (own, cumulative) in self.samples.items():
+            total = sum(own.values())
+            with open(f"{prefix}-{phase}.txt", "w") as f:
+                f.write(
+                    f"{total} stack samples, one every "
+                    f"{profile_sample_interval * 1000:g} ms of wall time, "
+                    f"waiting included\n\n"
+                )
+                f.write(f"{'cumulative':>10}{'own':>8}  function\n")
+                for where, count in cumulative.most_common(profile_top):
+                    f.write(f"{count / total:>10.1%}{own[where] / total:>8.1%}  {where}\n")
+            paths.append(f"{prefix}-{phase}.txt")
+        if self.memory:
+            with open(f"{prefix}-memory.txt", "w") as f:
+                f.write(f"Peak traced memory: {peak / 1024 / 1024:.1f} MB\n")
+                f.write(
+                    f"Traced memory at the end: {current / 1024 / 1024:.1f} MB\n\n"
+                )
+                f.write("Allocation sites holding the most at the end:\n")
+                for stat in snapshot.statistics("lineno")[:profile_top]:
+                    f.write(f"{stat}\n")
+            paths.append(f"{prefix}-memory.txt")
+        return paths
+
+
 class Udemy:
     def __init__(self, interface: str, debug: bool = False):
         self.interface = interface
@@ -525,6 +1953,13 @@ class Udemy:
 
         self.client.headers.update(headers)
         self.debug = debug
+        self.course_cache = JsonStore(course_cache_path, course_cache_ttl)
+        self.checkout_limiter = CheckoutLimiter()
+        self.seen_links = JsonStore(seen_links_path, max(seen_outcome_ttl.values()))
+        self.ledger = None
+        self.cart_size = checkout_cart_size
+        # Set to stop enrolling after the current course
+        self.stopping = threading.Event()
 
     def print(self, content: str, color: str, **kargs):
         colours_dict = {
@@ -566,6 +2001,8 @@ class Udemy:
         # v2.2
         if "course_update_threshold_months" not in self.settings:
             self.settings["course_update_threshold_months"] = 24  # 2 years
+        if "parse_processes" not in self.settings:
+            self.settings["parse_processes"] = scraper_parse_processes
 
         self.settings["languages"] = dict(
             sorted(self.settings["languages"].items(), key=lambda item: item[0])
@@ -596,17 +2033,65 @@ class Udemy:
     def get_enrolled_courses(self):
         """Get enrolled courses
         Sets enrolled_courses {id:enrollment_time}
+
+        Enrollments come newest first, so with a local snapshot only the pages
+        up to the first known course are fetched. Without one, or if the
+        total no longer matches, all pages are fetched in parallel.
         """
-        next_page = "https://www.udemy.com/api-2.0/users/me/subscribed-courses/?ordering=-enroll_time&fields[course]=enrollment_time&page_size=100"
+        url = "https://www.udemy.com/api-2.0/users/me/subscribed-courses/?ordering=-enroll_time&fields[course]=enrollment_time&page_size=100"
+        path = enrolled_snapshot_path.format(user=re.sub(r"\W", "_", self.user_id))
+        if getattr(self, "enrolled_user", None) == self.user_id:
+            # Logged in again in the same process, what we have is newer
+            known = self.enrolled_courses
+        else:
+            try:
+                with open(path) as f:
+                    known: dict = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                known = {}
+
+        r = self.client.get(url + "&page=1").json()
+        total = r["count"]
         courses = {}
-        while next_page:
-            r = self.client.get(
-                next_page,
-            ).json()
-            for course in r["results"]:
-                courses[str(course["id"])] = course["enrollment_time"]
-            next_page = r["next"]
+        if known:
+            while True:
+                new = {
+                    str(course["id"]): course["enrollment_time"]
+                    for course in r["results"]
+                }
+                courses.update({k: v for k, v in new.items() if k not in known})
+                if any(k in known for k in new) or not r["next"]:
+                    break
+                r = self.client.get(r["next"]).json()
+            courses.update(known)
+            if self.debug:
+                print(f"Enrolled sync: {len(courses) - len(known)} new")
+
+        if len(courses) != total:
+            courses = self.fetch_all_enrolled_courses(url, r if not known else None)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(courses, f)
         self.enrolled_courses = courses
+        self.enrolled_user = self.user_id
+
+    def fetch_all_enrolled_courses(self, url: str, first_page: dict = None) -> dict:
+        if first_page is None:
+            first_page = self.client.get(url + "&page=1").json()
+        pages = -(-first_page["count"] // 100)
+
+        def fetch_page(page):
+            return self.client.get(url + f"&page={page}").json()["results"]
+
+        results = [first_page["results"]]
+        with ThreadPoolExecutor(enrolled_sync_workers) as executor:
+            results.extend(executor.map(fetch_page, range(2, pages + 1)))
+        return {
+            str(course["id"]): course["enrollment_time"]
+            for page in results
+            for course in page
+        }
 
     def check_for_update(self) -> tuple[str, str]:
         r_version = (
@@ -755,6 +2240,7 @@ class Udemy:
             raise LoginException("Login Failed")
 
         self.display_name: str = r["header"]["user"]["display_name"]
+        self.user_id = str(r["header"]["user"].get("id", self.display_name))
         r = s.get(
             "https://www.udemy.com/api-2.0/shopping-carts/me/",
             headers=headers,
@@ -770,19 +2256,16 @@ class Udemy:
         self.client = s
         self.get_enrolled_courses()
 
+    def is_logged_in(self) -> bool:
+        """Whether the session of the client is still logged in"""
+        r = self.client.get("https://www.udemy.com/api-2.0/contexts/me/?header=True")
+        return r.json()["header"]["isLoggedIn"]
+
     def is_keyword_excluded(self, title: str) -> bool:
-        title_words = title.casefold().split()
-        for word in title_words:
-            word = word.casefold()
-            if word in self.title_exclude:
-                return True
-        return False
+        return self.exclusion_filter.title_rule(title) is not None
 
     def is_instructor_excluded(self, instructors: list) -> bool:
-        for instructor in instructors:
-            if instructor in self.settings["instructor_exclude"]:
-                return True
-        return False
+        return self.exclusion_filter.instructor_rule(instructors) is not None
 
     def is_course_updated(self, last_update: str | None) -> bool:
         if not last_update:
@@ -817,13 +2300,14 @@ class Udemy:
         self.instructor_exclude = self.settings["instructor_exclude"]
         self.title_exclude = self.settings["title_exclude"]
         self.min_rating = self.settings["min_rating"]
+        self.exclusion_filter = ExclusionFilter(self.settings)
         return not all([bool(self.sites), bool(self.categories), bool(self.languages)])
 
     def save_course(self):
+        # The ledger is the durable record, this file is for reading
         if self.settings["save_txt"]:
             self.txt_file.write(f"{self.title} - {self.link}\n")
             self.txt_file.flush()
-            os.fsync(self.txt_file.fileno())
 
     def remove_duplicate_courses(self):
         existing_links = set()
@@ -853,7 +2337,91 @@ class Udemy:
             )
         )
 
-    def get_course_id(self, url):
+    def read_body_tag(self, r: requests.Response) -> str | None:
+        """Reads a streamed page only up to the end of its <body> tag
+
+        Returns:
+            str: The <body ...> tag, None if the page has none
+        """
+        buffer = b""
+        start = end = -1
+        try:
+            for chunk in r.iter_content(32 * 1024):
+                scanned = max(len(buffer) - 5, 0)
+                buffer += chunk
+                if start == -1:
+                    start = buffer.find(b"<body", scanned)
+                    if start == -1:
+                        continue
+                    scanned = start
+                # Attribute values are HTML escaped, the first ">" closes the tag
+                end = buffer.find(b">", scanned)
+                if end != -1:
+                    break
+        finally:
+            r.close()
+        if start == -1 or end == -1:
+            return None
+        return buffer[start : end + 1].decode(r.encoding or "utf-8", "ignore")
+
+    def course_info_from_dma(self, dma: dict) -> dict:
+        course = dma["serverSideProps"]["course"]
+        return {
+            "is_paid": course.get("isPaid", True),
+            "instructors": [
+                i["absolute_url"].split("/")[-2]
+                for i in course["instructors"]["instructors_info"]
+                if i["absolute_url"]
+            ],
+            "language": course["localeSimpleEnglishTitle"],
+            "category": dma["serverSideProps"]["topicMenu"]["breadcrumbs"][0]["title"],
+            "rating": course["rating"],
+            "last_update": course["lastUpdateDate"],
+        }
+
+    def extract_course_info(self, module_args: str) -> dict:
+        """Pulls the fields we filter on out of data-module-args
+
+        Only the values we need are decoded, the rest of the blob is skipped.
+        Falls back to decoding the whole blob if its layout is unexpected.
+        """
+        try:
+            _, props = json_value(module_args, "serverSideProps")
+            _, course = json_value(module_args, "course", props)
+            _, topic_menu = json_value(module_args, "topicMenu", props)
+            instructors, _ = json_value(module_args, "instructors_info", course)
+            info = {
+                "is_paid": json_value(module_args, "isPaid", course)[0],
+                "instructors": [
+                    i["absolute_url"].split("/")[-2]
+                    for i in instructors
+                    if i["absolute_url"]
+                ],
+                "language": json_value(
+                    module_args, "localeSimpleEnglishTitle", course
+                )[0],
+                "category": json_value(module_args, "breadcrumbs", topic_menu)[0][0][
+                    "title"
+                ],
+                "rating": json_value(module_args, "rating", course)[0],
+                "last_update": json_value(module_args, "lastUpdateDate", course)[0],
+            }
+            if not (
+                isinstance(info["is_paid"], bool)
+                and isinstance(info["language"], str)
+                and isinstance(info["category"], str)
+                and isinstance(info["rating"], (int, float))
+            ):
+                raise ValueError("Unexpected data-module-args layout")
+            return info
+        except (KeyError, IndexError, TypeError, ValueError):
+            return self.course_info_from_dma(json.loads(module_args))
+
+    def course_slug(self, url: str) -> str:
+        path = urlparse(url).path.strip("/").split("/")
+        return path[1] if len(path) > 1 and path[0] == "course" else "/".join(path)
+
+    def get_course_id(self, url: str, title: str):
         course = {
             "course_id": None,
             "url": url,
@@ -864,70 +2432,81 @@ class Udemy:
             "msg": "Report to developer",
         }
         url = re.sub(r"\W+$", "", unquote(url))
-        try:
-            r = self.client.get(url)
-        except requests.exceptions.ConnectionError:
-            if self.debug:
-                print(r.text)
-            course["retry"] = True
-            return course
-        course["url"] = r.url
-        soup = bs(r.content, "html5lib")
+        slug = self.course_slug(url)
+        # Known courses skip the landing page, filters still use current settings
+        cached = self.course_cache.get(slug)
+        if cached:
+            course["course_id"] = cached["course_id"]
+            info = cached["info"]
+        else:
+            try:
+                # Brotli bodies get decoded in full by cloudscraper, so avoid them
+                r = self.client.get(
+                    url, stream=True, headers={"Accept-Encoding": "gzip, deflate"}
+                )
+                course["url"] = r.url
+                body = self.read_body_tag(r)
+            except requests.exceptions.ConnectionError:
+                course["retry"] = True
+                return course
+            attrs = {
+                name: html.unescape(value)
+                for name, value in re.findall(r'([\w-]+)="([^"]*)"', body or "")
+            }
 
-        course_id = soup.find("body").get("data-clp-course-id", "invalid")
+            course_id = attrs.get("data-clp-course-id", "invalid")
 
-        if course_id == "invalid":
-            course["is_invalid"] = True
-            course["msg"] = "Course ID not found: Report to developer"
-            return course
-        course["course_id"] = course_id
-        dma = json.loads(soup.find("body")["data-module-args"])
-        if self.debug:
-            with open("debug/dma.json", "w") as f:
-                json.dump(dma, f, indent=4)
-
-        if dma.get("view_restriction"):
-            course["is_invalid"] = True
-            course["msg"] = dma["serverSideProps"]["limitedAccess"]["errorMessage"][
-                "title"
-            ]
-            return course
+            if course_id == "invalid":
+                course["is_invalid"] = True
+                course["msg"] = "Course ID not found: Report to developer"
+                return course
+            course["course_id"] = course_id
+            module_args = attrs["data-module-args"]
+            if self.debug:
+                with open("debug/dma.json", "w") as f:
+                    json.dump(json.loads(module_args), f, indent=4)
 
-        course["is_free"] = not dma["serverSideProps"]["course"].get("isPaid", True)
-        if not self.debug and self.is_course_excluded(dma):
+            try:
+                view_restriction = json_value(module_args, "view_restriction")[0]
+            except KeyError:
+                view_restriction = None
+            if view_restriction:
+                dma = json.loads(module_args)
+                course["is_invalid"] = True
+                course["msg"] = dma["serverSideProps"]["limitedAccess"][
+                    "errorMessage"
+                ]["title"]
+                return course
+
+            info = self.extract_course_info(module_args)
+            self.course_cache.set(slug, {"course_id": course_id, "info": info})
+
+        course["is_free"] = not info["is_paid"]
+        if not self.debug and (reason := self.is_course_excluded(info, title)):
             course["is_excluded"] = True
+            course["msg"] = reason
             return course
 
         return course
 
-    def is_course_excluded(self, dma):
-        instructors = [
-            i["absolute_url"].split("/")[-2]
-            for i in dma["serverSideProps"]["course"]["instructors"]["instructors_info"]
-            if i["absolute_url"]
-        ]
-        lang = dma["serverSideProps"]["course"]["localeSimpleEnglishTitle"]
-        cat = dma["serverSideProps"]["topicMenu"]["breadcrumbs"][0]["title"]
-        rating = dma["serverSideProps"]["course"]["rating"]
-        last_update = dma["serverSideProps"]["course"]["lastUpdateDate"]
+    def is_course_excluded(self, info: dict, title: str) -> str | None:
+        """Returns why the course is excluded, None if it is not"""
+        last_update = info["last_update"]
+        rules = self.exclusion_filter
 
         if not self.is_course_updated(last_update):
-            self.print(
-                f"Course excluded: Last updated {last_update}", color="light blue"
-            )
-        elif self.is_instructor_excluded(instructors):
-            self.print(f"Instructor excluded: {instructors[0]}", color="light blue")
-        elif self.is_keyword_excluded(self.title):
-            self.print("Keyword Excluded", color="light blue")
-        elif cat not in self.categories:
-            self.print(f"Category excluded: {cat}", color="light blue")
-        elif lang not in self.languages:
-            self.print(f"Language excluded: {lang}", color="light blue")
-        elif rating < self.min_rating:
-            self.print(f"Low rating: {rating}", color="light blue")
-        else:
-            return False
-        return True
+            return f"Course excluded: Last updated {last_update}"
+        elif instructor := rules.instructor_rule(info["instructors"]):
+            return f"Instructor excluded: {instructor}"
+        elif keyword := rules.title_rule(title):
+            return f'Keyword Excluded: "{keyword}"'
+        elif cat := rules.category_rule(info["category"]):
+            return f"Category excluded: {cat}"
+        elif lang := rules.language_rule(info["language"]):
+            return f"Language excluded: {lang}"
+        elif rating := rules.rating_rule(info["rating"]):
+            return f"Low rating: {rating}"
+        return None
 
     def extract_course_coupon(self, url):
         params = parse_qs(urlsplit(url).query)
@@ -948,6 +2527,8 @@ class Udemy:
             .get("list_price", {})
             .get("amount", "retry")
         )
+        if amount == "retry":
+            return amount, False
         coupon_valid = False
 
         if coupon_code and "redeem_coupon" in r:
@@ -957,22 +2538,247 @@ class Udemy:
 
         return Decimal(amount), coupon_valid
 
-    def start_enrolling(self):
-        self.remove_duplicate_courses()
+    def start_enrolling(self, course_queue: CourseStream = None):
+        """Enrolls in the scraped courses
+
+        Args:
+            course_queue (CourseStream, optional): Queue from
+                Scraper.stream_courses. Courses are enrolled as they arrive
+                instead of from self.scraped_data.
+        """
         self.initialize_counters()
         self.setup_txt_file()
-
+        self.filters_fingerprint = self.exclusion_fingerprint()
+        self.run = time.strftime("%Y-%m-%d--%H-%M")
+        if self.ledger is None:
+            self.ledger = Ledger()
+        try:
+            if course_queue is not None:
+                self.enroll_from_queue(course_queue)
+            else:
+                self.enroll_from_scraped_data()
+        finally:
+            self.course_cache.save()
+            self.checkout_limiter.save()
+            self.seen_links.save()
+            self.ledger.flush()
+            if self.settings["save_txt"]:
+                self.txt_file.close()
+
+    def enroll_from_scraped_data(self):
+        self.remove_duplicate_courses()
         total_courses = sum(len(courses) for courses in self.scraped_data.values())
-        previous_courses_count = 0
-        for site_index, (site, courses) in enumerate(self.scraped_data.items()):
-            self.print(f"\nSite: {site} [{len(courses)}]", color="cyan")
+        self.enroll_courses(
+            (
+                (site, title, link, {})
+                for site, courses in self.scraped_data.items()
+                for title, link in courses
+            ),
+            total_courses,
+            {site: len(courses) for site, courses in self.scraped_data.items()},
+        )
 
-            for index, (title, link) in enumerate(courses):
-                self.title = title
-                self.link = link
-                self.print_course_info(previous_courses_count + index, total_courses)
-                self.handle_course_enrollment()
-            previous_courses_count += len(courses)
+    def enroll_from_queue(self, course_queue: queue.Queue):
+        self.enroll_courses(self.queued_courses(course_queue))
+
+    def queued_courses(self, course_queue: queue.Queue):
+        """Yields new courses from the queue, None while waiting for more"""
+        existing_links = set()
+        while True:
+            try:
+                course = course_queue.get(timeout=0.2)
+            except queue.Empty:
+                yield None
+                continue
+            if course is None:
+                return
+            site, title, link, meta = course
+            link = self.normalize_link(link)
+            if link not in existing_links:
+                existing_links.add(link)
+                yield site, title, link, meta
+
+    def enroll_courses(self, courses, total_courses=None, site_sizes=None):
+        """Checks courses in a thread pool and checks them out one at a time
+
+        Courses are checked in the order given. Those with a valid coupon
+        wait in a priority queue and are checked out, most valuable first,
+        whenever the checkout rate limit allows.
+
+        Args:
+            courses (iterable): (site, title, link, meta), or None when no
+                course is ready yet. meta is as in Scraper.append_to_list()
+            total_courses (int, optional): Shown next to the course index
+            site_sizes (dict, optional): Course count shown per site
+        """
+        pending = deque()
+        current_site = None
+        index = 0
+
+        def handle_next():
+            nonlocal current_site, index
+            site, title, link, meta, future = pending.popleft()
+            if site != current_site:
+                size = f" [{site_sizes[site]}]" if site_sizes else ""
+                self.print(f"\nSite: {site}{size}", color="cyan")
+                current_site = site
+            self.title = title
+            self.link = link
+            self.print_course_info(index, total_courses)
+            course = future.result()
+            course.update(meta, site=site, title=title, link=link)
+            self.course = course
+            self.handle_course_enrollment(course)
+            index += 1
+
+        with ThreadPoolExecutor(
+            enroll_validate_workers, thread_name_prefix="enroll-check"
+        ) as pool:
+            try:
+                for course in courses:
+                    if self.stopping.is_set():
+                        break
+                    if course is not None:
+                        site, title, link, meta = course
+                        if seen := self.known_outcome(link):
+                            # Handled on an earlier run, no need to ask Udemy
+                            future = Future()
+                            future.set_result({"seen": seen})
+                        else:
+                            future = pool.submit(self.validate_course, title, link)
+                        pending.append((site, title, link, meta, future))
+                    while pending and (
+                        len(pending) > enroll_validate_ahead or pending[0][4].done()
+                    ):
+                        handle_next()
+                    # Fill the cart while more courses are on the way
+                    while self.checkout_queue and self.checkout_limiter.ready():
+                        if pending or course is not None:
+                            if len(self.checkout_queue) < self.cart_size:
+                                break
+                        self.checkout_next()
+                # Courses left unhandled when stopping are checked next run
+                while pending and not self.stopping.is_set():
+                    handle_next()
+                while self.checkout_queue and not self.stopping.is_set():
+                    self.checkout_next()
+            finally:
+                for *_, future in pending:
+                    future.cancel()
+
+    def seen_key(self, link: str) -> str:
+        """(course slug, coupon) key of a link, whatever form the link is in"""
+        url = re.sub(r"\W+$", "", unquote(link))
+        return f"{self.course_slug(url)}|{self.extract_course_coupon(url) or ''}"
+
+    def exclusion_fingerprint(self) -> str:
+        """Hash of the settings that decide whether a course is excluded"""
+        keys = [
+            "categories",
+            "languages",
+            "min_rating",
+            "instructor_exclude",
+            "title_exclude",
+            "course_update_threshold_months",
+            "discounted_only",
+        ]
+        filters = {key: self.settings.get(key) for key in keys}
+        return hashlib.sha1(
+            json.dumps(filters, sort_keys=True).encode()
+        ).hexdigest()[:12]
+
+    def known_outcome(self, link: str) -> tuple | None:
+        """The outcome recorded for this course and coupon, if still valid
+
+        Returns:
+            tuple | None: (outcome, when) as saved by remember_outcome()
+        """
+        key = self.seen_key(link)
+        entry = self.seen_links.get(key)
+        if not entry:
+            return None
+        outcome, fingerprint = entry
+        stored_at = self.seen_links.stored_at(key)
+        if time.time() - stored_at > seen_outcome_ttl[outcome]:
+            return None
+        if fingerprint and fingerprint != self.filters_fingerprint:
+            return None
+        return outcome, stored_at
+
+    def remember_outcome(self, outcome: str):
+        """Records what happened to the current course (self.course)"""
+        fingerprint = self.filters_fingerprint if outcome == "excluded" else None
+        self.seen_links.set(self.seen_key(self.link), [outcome, fingerprint])
+        self.record_outcome(outcome)
+
+    def record_outcome(self, outcome: str):
+        course = self.course
+        self.ledger.record(
+            run=self.run,
+            site=course.get("site"),
+            title=self.title,
+            link=self.link,
+            course_id=course.get("course_id"),
+            coupon=course.get("coupon_code") or None,
+            outcome=outcome,
+            # Only an enrollment saves the list price
+            amount=(
+                float(course["amount"])
+                if outcome == "enrolled" and course.get("amount")
+                else None
+            ),
+            currency=self.currency,
+            check_seconds=course.get("check_seconds"),
+            checkout_seconds=course.get("checkout_seconds"),
+        )
+
+    def validate_course(self, title: str, link: str) -> dict:
+        """Everything about a course that can be checked before checkout
+
+        Runs in the check pool, so it only returns what it found.
+        """
+        started = time.perf_counter()
+        course = self.get_course_id(link, title)
+        for _ in range(enroll_check_retries):
+            if not course["retry"]:
+                break
+            time.sleep(1)
+            course = self.get_course_id(link, title)
+        course["title"] = title
+        course["link"] = link
+        if course["retry"]:
+            # Not the course's fault, so it is not remembered as invalid
+            course["retry_exhausted"] = True
+            course["msg"] = "Course page unreachable: Try again later"
+        if (
+            course.get("retry_exhausted")
+            or course["is_invalid"]
+            or course["is_excluded"]
+            or course["is_free"]
+            or course["course_id"] in self.enrolled_courses
+        ):
+            course["check_seconds"] = time.perf_counter() - started
+            return course
+        course["coupon_code"] = self.extract_course_coupon(link)
+        amount, coupon_valid = self.check_course(
+            course["course_id"], course["coupon_code"]
+        )
+        for _ in range(enroll_check_retries):
+            if amount != "retry":
+                break
+            time.sleep(1)
+            amount, coupon_valid = self.check_course(
+                course["course_id"], course["coupon_code"]
+            )
+        if amount == "retry":
+            course["retry_exhausted"] = True
+            course["msg"] = "Course price unavailable: Try again later"
+            course["check_seconds"] = time.perf_counter() - started
+            return course
+        course["amount"] = amount
+        course["coupon_valid"] = coupon_valid
+        course["check_seconds"] = time.perf_counter() - started
+        return course
 
     def initialize_counters(self):
         self.successfully_enrolled_c = 0
@@ -980,6 +2786,10 @@ class Udemy:
         self.expired_c = 0
         self.excluded_c = 0
         self.amount_saved_c = 0
+        self.checkout_queue = []
+        self.checkout_order = itertools.count()
+        # Queued course by id, other links to it wait in its "duplicates"
+        self.checkout_ids = {}
 
     def setup_txt_file(self):
         if self.settings["save_txt"]:
@@ -988,53 +2798,85 @@ class Udemy:
                 f"Courses/{time.strftime('%Y-%m-%d--%H-%M')}.txt", "w", encoding="utf-8"
             )
 
-    def print_course_info(self, index, total_courses):
-        self.print(f"[{index + 1} / {total_courses}] ", color="magenta", end=" ")
+    def print_course_info(self, index, total_courses=None):
+        if total_courses is None:
+            self.print(f"[{index + 1}] ", color="magenta", end=" ")
+        else:
+            self.print(f"[{index + 1} / {total_courses}] ", color="magenta", end=" ")
         self.print(self.title, color="yellow", end=" ")
         self.print(self.link, color="blue")
 
-    def handle_course_enrollment(self):
-        course = self.get_course_id(self.link)
-        if course["is_invalid"]:
+    def handle_course_enrollment(self, course: dict):
+        if seen := course.get("seen"):
+            self.handle_seen_course(*seen)
+        elif course.get("retry_exhausted"):
+            # Ledger only, the next run checks the link again
             self.print(course["msg"], color="red")
             self.excluded_c += 1
-        elif course["retry"]:
-            self.print("Retrying...", color="red")
-            time.sleep(1)
-            self.handle_course_enrollment()
+            self.record_outcome("unreachable")
+        elif course["is_invalid"]:
+            self.print(course["msg"], color="red")
+            self.excluded_c += 1
+            self.remember_outcome("invalid")
         elif course["is_excluded"]:
+            self.print(course["msg"], color="light blue")
             self.excluded_c += 1
+            self.remember_outcome("excluded")
         elif course["course_id"] in self.enrolled_courses:
             self.print(
                 f"You purchased this course on {self.get_date_from_utc(self.enrolled_courses[course['course_id']])}",
                 color="light blue",
             )
             self.already_enrolled_c += 1
+            self.remember_outcome("already_enrolled")
         elif course["is_free"]:
             self.handle_free_course(course["course_id"])
         elif not course["is_free"]:
-            self.handle_discounted_course(course["course_id"])
+            self.handle_discounted_course(course)
         else:
             self.print("Unknown Error: Report this link to the developer", color="red")
             self.excluded_c += 1
+            self.record_outcome("failed")
+
+    def handle_seen_course(self, outcome: str, seen_at: float):
+        self.record_outcome("skipped")
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(seen_at))
+        if outcome in ("enrolled", "already_enrolled"):
+            self.print(f"Enrolled on {when}", color="light blue")
+            self.already_enrolled_c += 1
+        elif outcome == "expired":
+            self.print(f"Coupon Expired (checked on {when})", color="red")
+            self.expired_c += 1
+        else:
+            self.print(f"Course {outcome} (checked on {when})", color="light blue")
+            self.excluded_c += 1
 
     def handle_free_course(self, course_id):
         if self.settings["discounted_only"]:
             self.print("Free course excluded", color="light blue")
             self.excluded_c += 1
+            self.remember_outcome("excluded")
         else:
             success = self.free_checkout(course_id)
             if success:
                 self.print("Successfully Subscribed", color="green")
                 self.successfully_enrolled_c += 1
                 self.save_course()
+                self.remember_outcome("enrolled")
             else:
                 self.print(
                     "Unknown Error: Report this link to the developer", color="red"
                 )
                 self.expired_c += 1
+                self.record_outcome("failed")
+
+    def discounted_checkout(self, courses: list) -> dict:
+        """Checks out one or more coupon courses in a single request
 
-    def discounted_checkout(self, coupon, course_id) -> dict:
+        Args:
+            courses (list): (coupon, course_id) pairs
+        """
+        coupon, course_id = courses[0]
         payload = {
             "checkout_environment": "Marketplace",
             "checkout_event": "Submit",
@@ -1046,10 +2888,11 @@ class Udemy:
             "shopping_info": {
                 "items": [
                     {
-                        "buyable": {"id": course_id, "type": "course"},
-                        "discountInfo": {"code": coupon},
+                        "buyable": {"id": item_id, "type": "course"},
+                        "discountInfo": {"code": item_coupon},
                         "price": {"amount": 0, "currency": self.currency.upper()},
                     }
+                    for item_coupon, item_id in courses
                 ],
                 "is_cart": True,
             },
@@ -1084,18 +2927,32 @@ class Udemy:
         else:
             raise ValueError("CSRF token not found")
 
+        if self.checkout_limiter.acquire(self.stopping) is None:
+            return {"status": "stopped", "message": "Stopped"}
         r = self.client.post(
             "https://www.udemy.com/payment/checkout-submit/",
             json=payload,
             headers=headers,
         )
+        if r.status_code in (401, 403):
+            # Every other checkout would fail the same way
+            raise LoginException("Session expired")
         try:
-            r = r.json()
+            body = r.json()
         except:
+            body = None
+        body = body if isinstance(body, dict) else None
+        throttled = self.checkout_limiter.update(r, body or {}) is not None
+        if throttled:
+            detail = (body or {}).get("detail") or f"Throttled ({r.status_code})"
+            return {"status": "throttled", "message": str(detail)}
+        if body is None:
             self.print(r.text, color="red")
             self.print("Unknown Error: Report this to the developer", color="red")
-            return {"status": "failed", "message": "Unknown Error"}        
-        return r
+            return {"status": "failed", "message": "Unknown Error"}
+        if detail := body.get("detail"):
+            return {"status": "failed", "message": str(detail)}
+        return body
 
     def free_checkout(self, course_id):
         self.client.get(f"https://www.udemy.com/course/subscribe/?courseId={course_id}")
@@ -1104,53 +2961,165 @@ class Udemy:
         ).json()
         return r.get("_class") == "course"
 
-    def handle_discounted_course(self, course_id):
-        coupon_code = self.extract_course_coupon(self.link)
-        amount, coupon_valid = self.check_course(course_id, coupon_code)
-        if amount == "retry":
-            self.print("Retrying...", color="red")
-            time.sleep(1)
-            self.handle_discounted_course(course_id)
-        elif coupon_valid:  # elif coupon_code and coupon_valid:
-            self.process_coupon(course_id, coupon_code, amount)
+    def handle_discounted_course(self, course: dict):
+        # Expired coupons were already found out in validate_course
+        if course["coupon_valid"] and course["course_id"] in self.checkout_ids:
+            # Settled by the queued link's checkout, see settle_duplicates()
+            self.checkout_ids[course["course_id"]]["duplicates"].append(course)
+            self.print("Already queued for checkout", color="light blue")
+        elif course["coupon_valid"]:
+            self.queue_checkout(course)
         else:
             self.print("Coupon Expired", color="red")
             self.expired_c += 1
+            self.remember_outcome("expired")
+
+    def queue_checkout(self, course: dict):
+        course.setdefault("duplicates", [])
+        self.checkout_ids[course["course_id"]] = course
+        heapq.heappush(
+            self.checkout_queue,
+            (self.checkout_priority(course), next(self.checkout_order), course),
+        )
+        self.print(
+            f"Queued for checkout [{len(self.checkout_queue)}]", color="light blue"
+        )
+
+    def settle_duplicates(self, course: dict, outcome: str):
+        """Settles the other links to a course once its checkout is over
+
+        If the course is now owned they are already enrolled. If its
+        checkout failed the next link gets its own checkout, with the rest
+        still waiting on it.
+        """
+        duplicates = course.pop("duplicates", [])
+        if not duplicates:
+            return
+        if outcome in ("enrolled", "already_enrolled"):
+            for duplicate in duplicates:
+                self.course = duplicate
+                self.title = duplicate["title"]
+                self.link = duplicate["link"]
+                self.print(self.title, color="yellow", end=" ")
+                self.print("Already Enrolled", color="light blue")
+                self.already_enrolled_c += 1
+                self.remember_outcome("already_enrolled")
+        else:
+            duplicate, *duplicates = duplicates
+            duplicate["duplicates"] = duplicates
+            self.print(duplicate["title"], color="yellow", end=" ")
+            self.print("Trying another link to it", color="light blue", end=" ")
+            self.queue_checkout(duplicate)
+
+    def checkout(self, courses: list) -> dict:
+        for _ in range(checkout_retries):
+            checkout_response = self.discounted_checkout(courses)
+            if checkout_response.get("status") != "throttled":
+                return checkout_response
+            # The checkout limiter holds the next attempt back
+            self.print(checkout_response["message"], color="red")
+        return {"status": "failed", "message": "Throttled: Try again later"}
+
+    def checkout_priority(self, course: dict) -> tuple:
+        """Sort key for the checkout queue, lowest goes first
+
+        Highest list price first, then the coupon that expires soonest,
+        then the one listed the longest ago.
+        """
+        return (
+            -course["amount"],
+            course.get("expires") or float("inf"),
+            course.get("first_seen") or float("inf"),
+        )
+
+    def checkout_next(self):
+        """Checks out the best courses in the checkout queue, a cart's worth"""
+        cart = {}
+        while self.checkout_queue and len(cart) < self.cart_size:
+            course = heapq.heappop(self.checkout_queue)[2]
+            self.checkout_ids.pop(course["course_id"], None)
+            if course["course_id"] in cart:
+                # One course twice in a cart would fail it as a whole
+                cart[course["course_id"]]["duplicates"] += [
+                    course,
+                    *course.pop("duplicates", []),
+                ]
+            else:
+                cart[course["course_id"]] = course
+        self.checkout_cart(list(cart.values()))
+
+    def checkout_cart(self, cart: list):
+        """Checks out every course in the cart with one request
+
+        If the cart as a whole fails, each course is checked out on its own
+        so one bad item does not cost the others.
+        """
+        if not cart:
+            return
+        if len(cart) > 1:
+            self.print(f"\nChecking out {len(cart)} courses", color="cyan")
+            started = time.perf_counter()
+            checkout_response = self.checkout(
+                [(course["coupon_code"], course["course_id"]) for course in cart]
+            )
+            if checkout_response.get("status") == "stopped":
+                return
+            if checkout_response["status"] == "succeeded":
+                for course in cart:
+                    course["checkout_seconds"] = time.perf_counter() - started
+                    self.course = course
+                    self.title = course["title"]
+                    self.link = course["link"]
+                    self.print(self.title, color="yellow", end=" ")
+                    self.course_enrolled(course["course_id"], course["amount"])
+                return
+            self.print("Cart checkout failed, checking out one by one", color="red")
+        for course in cart:
+            self.course = course
+            self.title = course["title"]
+            self.link = course["link"]
+            self.print(self.title, color="yellow", end=" ")
+            self.process_coupon(
+                course["course_id"], course["coupon_code"], course["amount"]
+            )
+
+    def course_enrolled(self, course_id, amount):
+        self.print("Successfully Enrolled To Course :)", color="green")
+        self.print(
+            "This course would have cost you " + str(round(amount, 2)) + " EUR. Enjoy!",
+            color="green",
+        )
+        self.successfully_enrolled_c += 1
+        self.enrolled_courses[course_id] = self.get_now_to_utc()
+        self.amount_saved_c += amount
+        self.save_course()
+        self.remember_outcome("enrolled")
+        self.settle_duplicates(self.course, "enrolled")
 
     def process_coupon(self, course_id, coupon_code, amount):
-        checkout_response = self.discounted_checkout(coupon_code, course_id)
-        if msg := checkout_response.get("detail"):
-            self.print(msg, color="red")
-            try:
-                wait_time = int(re.search(r"\d+", checkout_response["detail"]).group(0))
-            except:
-                self.print(
-                    "Unknown Error: Report this link to the developer", color="red"
-                )
-                self.print(checkout_response, color="red")
-                wait_time = 60
-            time.sleep(wait_time + 1.5)
-            self.process_coupon(course_id, coupon_code, amount)
+        started = time.perf_counter()
+        checkout_response = self.checkout([(coupon_code, course_id)])
+        self.course["checkout_seconds"] = time.perf_counter() - started
+        if checkout_response["status"] == "stopped":
+            # Left for the next run
+            self.print("Stopped", color="light blue")
         elif checkout_response["status"] == "succeeded":
-            self.print("Successfully Enrolled To Course :)", color="green")
-            self.print(
-                "This course would have cost you " + str(round(amount, 2)) + " EUR. Enjoy!",
-                color="green",
-            )
-            self.successfully_enrolled_c += 1
-            self.enrolled_courses[course_id] = self.get_now_to_utc()
-            self.amount_saved_c += amount
-            self.save_course()
-            time.sleep(3.8)
+            self.course_enrolled(course_id, amount)
         elif checkout_response["status"] == "failed":
             message = checkout_response["message"]
             if "item_already_subscribed" in message:
                 self.print("Already Enrolled", color="light blue")
                 self.already_enrolled_c += 1
+                self.remember_outcome("already_enrolled")
+                self.settle_duplicates(self.course, "already_enrolled")
             else:
                 self.print("Unknown Error: Report this to the developer", color="red")
-                self.print(checkout_response)
+                self.print(str(checkout_response), color="red")
+                self.record_outcome("failed")
+                self.settle_duplicates(self.course, "failed")
         else:
             self.print("Unknown Error: Report this to the developer", color="red")
-            self.print(checkout_response)
+            self.print(str(checkout_response), color="red")
+            self.record_outcome("failed")
+            self.settle_duplicates(self.course, "failed")
 
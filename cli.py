@@ -1,118 +1,257 @@
-import threading
+import argparse
+import multiprocessing
+import random
+import signal
 import time
 import traceback
 
 from tqdm import tqdm
 
-from base import VERSION, LoginException, Scraper, Udemy, scraper_dict
-from colors import bw, by, fb, fg, fr
+from base import VERSION, LoginException, RunProfiler, Scraper, Udemy
+from colors import bw, by, fb, fg, fr, fy
 
 # DUCE-CLI
 
 
-def create_scraping_thread(site: str):
+progress_bars = {}
+daemon_interval = 6  # hours between runs, the four daily runs of Task Template.xml
+daemon_jitter = 60 * 60  # up to this many seconds later, like its RandomDelay
 
-    code_name = scraper_dict[site]
-    try:
-        t = threading.Thread(target=getattr(scraper, code_name), daemon=True)
-        t.start()
-
-        while getattr(scraper, f"{code_name}_length") == 0:
-            time.sleep(0.1)  # Avoid busy waiting
-        if getattr(scraper, f"{code_name}_length") == -1:
-            raise Exception(f"Error in: {site}")
-        progress_bar = tqdm(
-            total=getattr(scraper, f"{code_name}_length"), desc=site, leave=False
-        )
-        prev_progress = -1
-
-        while not getattr(scraper, f"{code_name}_done"):
-            time.sleep(0.1)
-            current_progress = getattr(scraper, f"{code_name}_progress")
-            progress_bar.update(current_progress - prev_progress)
-            prev_progress = current_progress
 
-        progress_bar.update(getattr(scraper, f"{code_name}_length") - prev_progress)
-
-    except Exception:
-        error = getattr(scraper, f"{code_name}_error", traceback.format_exc())
-        print(error)
+def show_progress(event: str, site: str, value=None):
+    if event == "length":
+        progress_bars[site] = tqdm(total=value, desc=site, leave=False)
+    elif event == "progress" and site in progress_bars:
+        progress_bars[site].update(value - progress_bars[site].n)
+    elif event == "error":
+        print(value)
         print("\nError in: " + site + " " + str(VERSION))
+    if event in ("error", "finished") and site in progress_bars:
+        progress_bars.pop(site).close()
 
 
-##########################################
+def relogin(udemy: Udemy) -> bool:
+    """Logs in again with the saved method, without asking anything
 
-udemy = Udemy("cli")
-udemy.load_settings()
-login_title, main_title = udemy.check_for_update()
-if login_title.__contains__("Update"):
-    print(by + fr + login_title)
-
-############## MAIN #############
-
-login_successful = False
-while not login_successful:
+    Returns:
+        bool: Whether it worked
+    """
     try:
         if udemy.settings["use_browser_cookies"]:
             udemy.fetch_cookies()
-            login_method = "Browser Cookies"
         elif udemy.settings["email"] and udemy.settings["password"]:
-            email, password = udemy.settings["email"], udemy.settings["password"]
-            login_method = "Saved Email and Password"
+            udemy.manual_login(udemy.settings["email"], udemy.settings["password"])
         else:
-            email = input("Email: ")
-            password = input("Password: ")
-            login_method = "Email and Password"
-        print(fb + f"Trying to login using {login_method}")
-        if "Email" in login_method:
-            udemy.manual_login(email, password)
+            return False
         udemy.get_session_info()
-        if "Email" in login_method:
-            udemy.settings["email"], udemy.settings["password"] = email, password
-        login_successful = True
     except LoginException as e:
         print(fr + str(e))
-        if "Browser" in login_method:
-            print("Cant login using cookies")
-            udemy.settings["use_browser_cookies"] = False
-        elif "Email" in login_method:
-            udemy.settings["email"], udemy.settings["password"] = "", ""
-
-udemy.save_settings()
-
-print(fg + f"Logged in as {udemy.display_name}")
-user_dumb = udemy.is_user_dumb()
-if user_dumb:
-    print(bw + fr + "What do you even expect to happen!")
-    exit()
-if not user_dumb:
-    scraper = Scraper(udemy.sites)
-try:
-    udemy.scraped_data = scraper.get_scraped_courses(create_scraping_thread)
-    time.sleep(0.5)
-    print("\n")
-    udemy.start_enrolling()
-
-    udemy.print(
-        f"\nSuccessfully Enrolled: {udemy.successfully_enrolled_c}", color="green"
-    )
-    udemy.print(
-        f"Amount Saved: {round(udemy.amount_saved_c,2)} {udemy.currency.upper()}",
-        color="light green",
+        return False
+    return True
+
+
+def run_once(
+    udemy: Udemy, scraper: Scraper, profile: bool = False, profile_memory: bool = False
+) -> bool:
+    """Scrapes and enrolls, then prints the results
+
+    Returns:
+        bool: False if the session expired during the run
+    """
+    logged_in = True
+    profiler = (
+        RunProfiler(memory=profile_memory) if profile or profile_memory else None
     )
-    udemy.print(f"Already Enrolled: {udemy.already_enrolled_c}", color="blue")
-    udemy.print(f"Excluded Courses: {udemy.excluded_c}", color="yellow")
-    udemy.print(f"Expired Courses: {udemy.expired_c}", color="red")
-
-    new_enrolled_courses_c = len(udemy.enrolled_courses) + udemy.successfully_enrolled_c
-    udemy.print(f"Total Enrolled Courses: {new_enrolled_courses_c}", color="magenta")
-
-except:
-    e = traceback.format_exc()
-    print(
-        (
-            "Error",
-            e + f"\n\n{udemy.link}\n{udemy.title}" + f"|:|Unknown Error {VERSION}",
+    course_queue = None
+    try:
+        if profiler:
+            profiler.start()
+        course_queue = scraper.stream_courses(show_progress)
+        udemy.start_enrolling(course_queue)
+        if not udemy.stopping.is_set():
+            scraper.mark_listed()
+
+        udemy.print(
+            f"\nSuccessfully Enrolled: {udemy.successfully_enrolled_c}", color="green"
         )
+        udemy.print(
+            f"Amount Saved: {round(udemy.amount_saved_c,2)} {udemy.currency.upper()}",
+            color="light green",
+        )
+        udemy.print(f"Already Enrolled: {udemy.already_enrolled_c}", color="blue")
+        udemy.print(f"Excluded Courses: {udemy.excluded_c}", color="yellow")
+        udemy.print(f"Expired Courses: {udemy.expired_c}", color="red")
+
+        new_enrolled_courses_c = len(udemy.enrolled_courses) + udemy.successfully_enrolled_c
+        udemy.print(f"Total Enrolled Courses: {new_enrolled_courses_c}", color="magenta")
+
+    except LoginException as e:
+        print(fr + str(e))
+        logged_in = False
+    except Exception:
+        e = traceback.format_exc()
+        print(
+            (
+                "Error",
+                e + f"\n\n{udemy.link}\n{udemy.title}" + f"|:|Unknown Error {VERSION}",
+            )
+        )
+    # An enrollment that failed or was stopped leaves the scrape running
+    if course_queue is not None:
+        course_queue.cancel()
+    if profiler:
+        for path in profiler.stop():
+            print(fb + f"Profile saved to {path}")
+    return logged_in
+
+
+def run_daemon(
+    udemy: Udemy,
+    scraper: Scraper,
+    interval: float,
+    profile: bool = False,
+    profile_memory: bool = False,
+):
+    """Runs every `interval` hours until SIGINT or SIGTERM
+
+    The login, enrolled courses, scraper sessions and caches stay warm
+    between runs. A stop request lets the current course finish; a second
+    Ctrl+C quits at once. A session that expires during a run is renewed
+    and the run repeated once.
+    """
+
+    def stop(signum, frame):
+        if udemy.stopping.is_set():
+            raise KeyboardInterrupt
+        print(fy + "\nStopping after the current course, Ctrl+C again to quit now")
+        udemy.stopping.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    while not udemy.stopping.is_set():
+        started = time.time()
+        try:
+            logged_in = udemy.is_logged_in()
+            if not logged_in:
+                print(fy + "Session expired, logging in again")
+                logged_in = relogin(udemy)
+        except Exception:
+            traceback.print_exc()
+            logged_in = False
+        if logged_in:
+            scraper.reset()
+            logged_in = run_once(udemy, scraper, profile, profile_memory)
+            if not logged_in and not udemy.stopping.is_set():
+                # What the run did not get to is picked up again right away
+                print(fy + "Logging in again")
+                if relogin(udemy):
+                    scraper.reset()
+                    run_once(udemy, scraper, profile, profile_memory)
+        else:
+            print(fr + "Not logged in, trying again on the next run")
+        next_run = started + interval * 60 * 60 + random.uniform(0, daemon_jitter)
+        if not udemy.stopping.is_set():
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(next_run))
+            print(fb + f"Next run at {when}")
+        # Short waits, so signals get through on Windows too
+        while not udemy.stopping.wait(min(max(next_run - time.time(), 0), 1)):
+            if time.time() >= next_run:
+                break
+    print(fg + "Stopped")
+
+
+##########################################
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Discounted Udemy Course Enroller")
+    arg_parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Save CPU profiles of the scrape and enroll phases to Profiles/",
+    )
+    arg_parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="Also trace memory while profiling. Pure-Python code ran 4 to 11 "
+        "times slower under it, so keep it out of scheduled runs",
     )
-input("Press Enter to exit...")
+    arg_parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and enroll on a schedule instead of once",
+    )
+    arg_parser.add_argument(
+        "--interval",
+        type=float,
+        default=daemon_interval,
+        help="Hours between runs in daemon mode",
+    )
+    args = arg_parser.parse_args()
+
+    udemy = Udemy("cli")
+    udemy.load_settings()
+    login_title, main_title = udemy.check_for_update()
+    if login_title.__contains__("Update"):
+        print(by + fr + login_title)
+
+    ############## MAIN #############
+
+    login_successful = False
+    while not login_successful:
+        try:
+            if udemy.settings["use_browser_cookies"]:
+                udemy.fetch_cookies()
+                login_method = "Browser Cookies"
+            elif udemy.settings["email"] and udemy.settings["password"]:
+                email, password = udemy.settings["email"], udemy.settings["password"]
+                login_method = "Saved Email and Password"
+            else:
+                email = input("Email: ")
+                password = input("Password: ")
+                login_method = "Email and Password"
+            print(fb + f"Trying to login using {login_method}")
+            if "Email" in login_method:
+                udemy.manual_login(email, password)
+            udemy.get_session_info()
+            if "Email" in login_method:
+                udemy.settings["email"], udemy.settings["password"] = email, password
+            login_successful = True
+        except LoginException as e:
+            print(fr + str(e))
+            if "Browser" in login_method:
+                print("Cant login using cookies")
+                udemy.settings["use_browser_cookies"] = False
+            elif "Email" in login_method:
+                udemy.settings["email"], udemy.settings["password"] = "", ""
+
+    udemy.save_settings()
+
+    print(fg + f"Logged in as {udemy.display_name}")
+    user_dumb = udemy.is_user_dumb()
+    if user_dumb:
+        print(bw + fr + "What do you even expect to happen!")
+        exit()
+    if not user_dumb:
+        scraper = Scraper(
+            udemy.sites,
+            parse_processes=udemy.settings["parse_processes"],
+            course_filter=udemy.exclusion_filter.listing_rule,
+        )
+    if args.daemon:
+        try:
+            run_daemon(
+                udemy, scraper, args.interval, args.profile, args.profile_memory
+            )
+        finally:
+            scraper.close()
+        return
+    run_once(udemy, scraper, args.profile, args.profile_memory)
+    scraper.close()
+    input("Press Enter to exit...")
+
+
+if __name__ == "__main__":
+    # Frozen builds and spawned parse workers re-import this module
+    multiprocessing.freeze_support()
+    main()
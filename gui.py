@@ -6,7 +6,7 @@ from webbrowser import open as web
 
 import FreeSimpleGUI as sg
 
-from base import LINKS, VERSION, LoginException, Scraper, Udemy, scraper_dict
+from base import LINKS, VERSION, LoginException, Scraper, Udemy
 from images import (
     auto_login,
     back,
@@ -40,35 +40,24 @@ def update_enrolled_courses():
         time.sleep(10)
 
 
-def create_scraping_thread(site: str):
-    code_name = scraper_dict[site]
-    main_window[f"i{site}"].update(visible=False)
-    main_window[f"p{site}"].update(0, visible=True)
+def show_progress(event: str, site: str, value=None):
+    # Called from scraping threads, the window is updated in the event loop
+    main_window.write_event_value("Scrape-Progress", (event, site, value))
 
-    try:
-        threading.Thread(target=getattr(scraper, code_name), daemon=True).start()
-        while getattr(scraper, f"{code_name}_length") == 0:
-            time.sleep(0.1)  # Avoid busy waiting
-        if getattr(scraper, f"{code_name}_length") == -1:
-            raise Exception(f"Error in: {site}")
-
-        main_window[f"p{site}"].update(0, max=getattr(scraper, f"{code_name}_length"))
-        while not getattr(scraper, f"{code_name}_done") and not getattr(
-            scraper, f"{code_name}_error"
-        ):
-            main_window[f"p{site}"].update(
-                getattr(scraper, f"{code_name}_progress") + 1
-            )
-            time.sleep(0.1)  # Update every 0.1 seconds
 
-        if getattr(scraper, f"{code_name}_error"):
-            raise Exception(f"Error in: {site}")
-    except Exception:
-        error_message = getattr(scraper, f"{code_name}_error", "Unknown Error")
+def update_progress(event: str, site: str, value=None):
+    if event == "started":
+        main_window[f"i{site}"].update(visible=False)
+        main_window[f"p{site}"].update(0, visible=True)
+    elif event == "length":
+        main_window[f"p{site}"].update(0, max=max(value, 1))
+    elif event == "progress":
+        main_window[f"p{site}"].update(value)
+    elif event == "error":
         main_window.write_event_value(
-            "Error", f"{error_message}|:|Unknown Error in: {site} {VERSION}"
+            "Error", f"{value}|:|Unknown Error in: {site} {VERSION}"
         )
-    finally:
+    if event in ("error", "finished"):
         main_window[f"p{site}"].update(0, visible=False)
         main_window[f"i{site}"].update(visible=True)
 
@@ -77,16 +66,18 @@ def create_scraping_thread(site: str):
 
 
 def scrape():
+    course_queue = None
     try:
         for site in udemy.sites:
             main_window[f"pcol{site}"].update(visible=True)
         main_window["main_col"].update(visible=False)
         main_window["scrape_col"].update(visible=True)
-        udemy.scraped_data = scraper.get_scraped_courses(create_scraping_thread)
-        main_window["scrape_col"].update(visible=False)
         main_window["output_col"].update(visible=True)
+        course_queue = scraper.stream_courses(show_progress)
         # ------------------------------------------
-        udemy.start_enrolling()
+        udemy.start_enrolling(course_queue)
+        scraper.mark_listed()
+        main_window["scrape_col"].update(visible=False)
         main_window["output_col"].Update(visible=False)
 
         main_window["done_col"].update(visible=True)
@@ -109,6 +100,11 @@ def scrape():
             "Error",
             f"{e}\n\nVersion:{VERSION}\nLink:{getattr(udemy, 'link', 'None')}\nTitle:{getattr(udemy, 'title','None')}|:|Error g100",
         )
+    finally:
+        # An enrollment that failed leaves the scrape running
+        if course_queue is not None:
+            course_queue.cancel()
+        scraper.close()
 
 
 #################################
@@ -665,7 +661,9 @@ while True:
                 no_titlebar=True,
             )
             continue
-        scraper = Scraper(udemy.sites)
+        scraper = Scraper(
+            udemy.sites, course_filter=udemy.exclusion_filter.listing_rule
+        )
         udemy.window = main_window
         threading.Thread(target=scrape, daemon=True).start()
 
@@ -677,4 +675,6 @@ while True:
     elif event == "Update-Menu":
         menu = values["Update-Menu"]
         main_window["mn"].update(menu)
+    elif event == "Scrape-Progress":
+        update_progress(*values["Scrape-Progress"])
 main_window.close()
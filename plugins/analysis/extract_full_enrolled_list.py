@@ -1,6 +1,9 @@
 import os
+import sqlite3
 import pandas as pd
 
+LEDGER_PATH = "../../Courses/ledger.db"
+
 def courses_list_get_files():
     """
     Retrieve all text files from the 'Courses' directory that match the naming convention.
@@ -61,6 +64,62 @@ def courses_list_process_data(data):
         })
     return courses
 
+def courses_list_query_ledger():
+    """
+    Read enrolled courses from the ledger the enroller keeps in 'Courses/ledger.db'.
+    Unlike the text files, it also holds the site, price and date of each enrollment.
+
+    Returns:
+        list: A list of dictionaries with course details, oldest first.
+    """
+    # Open read-only, the enroller may be writing to it at the same time
+    db = sqlite3.connect(f"file:{LEDGER_PATH}?mode=ro", uri=True)
+    db.row_factory = sqlite3.Row
+    rows = db.execute(
+        "SELECT title, link, site, amount, currency, "
+        "datetime(processed_at, 'unixepoch', 'localtime') AS enrolled_at "
+        "FROM courses WHERE outcome = 'enrolled' ORDER BY processed_at"
+    ).fetchall()
+    db.close()
+    courses = []
+    for row in rows:
+        courses.append({
+            "name": row["title"],
+            "url": row["link"],
+            "status": "Not Enrolled",
+            "site": row["site"],
+            "price": row["amount"],
+            "currency": row["currency"],
+            "enrolled_at": row["enrolled_at"],
+        })
+    return courses
+
+def courses_list_merge(file_courses, ledger_courses):
+    """
+    Combine the courses from the text files with those from the ledger.
+    Enrollments from before the ledger existed are only in the text files.
+
+    Args:
+        file_courses (list): Courses read from the text files.
+        ledger_courses (list): Courses read from the ledger.
+
+    Returns:
+        list: Each course once, by URL, with the ledger's details when it has them.
+    """
+    ledger_urls = {course["url"] for course in ledger_courses}
+    courses = []
+    seen = set()
+    for course in file_courses:
+        # Courses the ledger also holds are added with its details below
+        if course["url"] not in ledger_urls and course["url"] not in seen:
+            seen.add(course["url"])
+            courses.append(course)
+    for course in ledger_courses:
+        if course["url"] not in seen:
+            seen.add(course["url"])
+            courses.append(course)
+    return courses
+
 def format_courses_list(courses):
     """
     Convert the list of courses into a pandas DataFrame for better formatting.
@@ -96,6 +155,9 @@ def main():
     data = courses_list_load_files(files)
     # Process the data into structured course information
     courses = courses_list_process_data(data)
+    if os.path.exists(LEDGER_PATH):
+        # Add what the ledger knows, runs before it are only in the files
+        courses = courses_list_merge(courses, courses_list_query_ledger())
     # Format the courses into a DataFrame
     df = format_courses_list(courses)
     # Ensure the output directories exist
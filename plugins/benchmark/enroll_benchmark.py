@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from mock_udemy import MockUdemy, mock_udemy_client
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+
+from base import Udemy, checkout_cart_size, checkout_interval  # noqa: E402
+
+
+def run_enrollment(server, courses, cart_size, interval):
+    """
+    Enroll `courses` fake links against the mock, as start_enrolling does
+    after a scrape.
+
+    Returns:
+        dict: Timings and counters of the run
+    """
+    udemy = Udemy("cli")
+    mock_udemy_client(udemy, server.url)
+    udemy.print = lambda *args, **kwargs: None
+    udemy.cart_size = cart_size
+    udemy.checkout_limiter.interval = interval
+    udemy.scraped_data = {
+        "Mock": [
+            (
+                f"Mock Course {index}",
+                f"https://www.udemy.com/course/mock-{index}/?couponCode=MOCK{index % 97}",
+            )
+            for index in range(courses)
+        ]
+    }
+    started = time.perf_counter()
+    udemy.start_enrolling()
+    elapsed = time.perf_counter() - started
+    udemy.ledger.close()
+    limiter = udemy.checkout_limiter
+    return {
+        "courses": courses,
+        "elapsed": elapsed,
+        "courses_per_min": courses / elapsed * 60,
+        "throttle_sleep": limiter.waited,
+        "throttles": limiter.throttles,
+        "checkouts": server.checkouts,
+        "enrolled": udemy.successfully_enrolled_c,
+        "expired": udemy.expired_c,
+        "excluded": udemy.excluded_c,
+        "requests": dict(server.requests),
+    }
+
+
+def main():
+    """
+    Measure enrollment throughput against the mock Udemy server.
+    """
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument(
+        "--courses", type=int, nargs="*", default=[100, 1000, 10000]
+    )
+    arg_parser.add_argument("--latency", type=float, default=0.05)
+    arg_parser.add_argument(
+        "--min-interval",
+        type=float,
+        default=1.0,
+        help="Throttle checkouts closer together than this many seconds",
+    )
+    arg_parser.add_argument("--expired-ratio", type=float, default=0.2)
+    arg_parser.add_argument("--free-ratio", type=float, default=0.1)
+    arg_parser.add_argument("--cart-size", type=int, default=checkout_cart_size)
+    arg_parser.add_argument(
+        "--checkout-interval",
+        type=float,
+        default=checkout_interval,
+        help="Checkout pace the limiter starts from, in seconds",
+    )
+    arg_parser.add_argument("--json", help="Also save the results to this file")
+    args = arg_parser.parse_args()
+
+    results = []
+    print(
+        f"{'courses':>8}{'total':>10}{'courses/min':>13}{'throttle sleep':>16}"
+        f"{'throttles':>11}{'checkouts':>11}{'enrolled':>10}"
+    )
+    for courses in args.courses:
+        # A fresh server per run, so nothing is already enrolled
+        server = MockUdemy(
+            ("127.0.0.1", 0),
+            args.min_interval,
+            latency=args.latency,
+            expired_ratio=args.expired_ratio,
+            free_ratio=args.free_ratio,
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            result = run_enrollment(
+                server, courses, args.cart_size, args.checkout_interval
+            )
+        finally:
+            server.shutdown()
+            server.server_close()
+        results.append(result)
+        print(
+            f"{courses:>8}{result['elapsed']:>9.1f}s{result['courses_per_min']:>13.0f}"
+            f"{result['throttle_sleep']:>15.1f}s{result['throttles']:>11}"
+            f"{result['checkouts']:>11}{result['enrolled']:>10}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+
+from base import ExclusionFilter  # noqa: E402
+
+
+def random_word(rng):
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10)))
+
+
+def make_settings(rng, entries):
+    """
+    Settings with `entries` title keywords (a quarter of them phrases) and
+    as many excluded instructors.
+    """
+    title_exclude = []
+    for index in range(entries):
+        words = 1 if index % 4 else rng.randint(2, 4)
+        title_exclude.append(" ".join(random_word(rng) for _ in range(words)))
+    return {
+        "title_exclude": title_exclude,
+        "instructor_exclude": [random_word(rng) for _ in range(entries)],
+        "categories": {"Development": True, "Music": False},
+        "languages": {"English": True, "Spanish": True},
+        "min_rating": 0.0,
+    }
+
+
+def make_titles(rng, settings, count):
+    """
+    Course titles of 6-12 words, one in ten containing an excluded entry.
+    """
+    titles = []
+    for index in range(count):
+        words = [random_word(rng) for _ in range(rng.randint(6, 12))]
+        if index % 10 == 0:
+            entry = rng.choice(settings["title_exclude"])
+            words.insert(rng.randrange(len(words)), entry)
+        titles.append(" ".join(words))
+    return titles
+
+
+def linear_title_excluded(title, title_exclude):
+    """
+    The previous check: each title word against the list, plus a scan for
+    phrases, which the old check could not match at all.
+    """
+    words = title.casefold().split()
+    for word in words:
+        if word in title_exclude:
+            return True
+    title = f" {' '.join(words)} "
+    return any(" " in entry and f" {entry} " in title for entry in title_exclude)
+
+
+def best_time(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    """
+    Compare the compiled ExclusionFilter with linear list scans.
+    """
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument(
+        "--entries", type=int, nargs="*", default=[10, 100, 1000, 5000]
+    )
+    arg_parser.add_argument("--titles", type=int, default=2000)
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    rng = random.Random(0)
+    print(
+        f"{'entries':>8}{'compile':>12}{'linear':>14}{'compiled':>14}{'matches':>10}"
+    )
+    for entries in args.entries:
+        settings = make_settings(rng, entries)
+        titles = make_titles(rng, settings, args.titles)
+        title_exclude = [entry.casefold() for entry in settings["title_exclude"]]
+
+        start = time.perf_counter()
+        rules = ExclusionFilter(settings)
+        compile_time = time.perf_counter() - start
+
+        linear = best_time(
+            lambda: [linear_title_excluded(t, title_exclude) for t in titles],
+            args.repeat,
+        )
+        compiled = best_time(
+            lambda: [rules.title_rule(t) for t in titles], args.repeat
+        )
+        matches = sum(rules.title_rule(t) is not None for t in titles)
+        expected = sum(linear_title_excluded(t, title_exclude) for t in titles)
+        assert matches == expected, (matches, expected)
+
+        per_title = 1e6 / len(titles)
+        print(
+            f"{entries:>8}{compile_time * 1000:>10.2f}ms"
+            f"{linear * per_title:>12.2f}us{compiled * per_title:>12.2f}us{matches:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
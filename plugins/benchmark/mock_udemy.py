@@ -0,0 +1,407 @@
+import argparse
+import hashlib
+import html
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+
+from base import (  # noqa: E402
+    CheckoutLimiter,
+    JsonStore,
+    Ledger,
+    Udemy,
+    course_cache_ttl,
+    seen_outcome_ttl,
+)
+
+SETTINGS_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "../../default-duce-cli-settings.json"
+)
+# Landing pages are large and the course id sits in the <body> tag after the
+# <head>, so the client has to read past this much before it finds it
+LANDING_HEAD = "<head>" + "<meta name='filler' content='mock'>" * 500 + "</head>"
+
+
+def fraction(key):
+    """Stable pseudo-random number in [0, 1) for a key"""
+    return int(hashlib.sha1(key.encode()).hexdigest()[:8], 16) / 2**32
+
+
+class MockUdemy(ThreadingHTTPServer):
+    """
+    Local stand-in for the Udemy endpoints used while enrolling: course
+    landing pages, course-landing-components, subscribed-courses, the free
+    subscribe link and checkout-submit.
+
+    Courses exist for any /course/<slug>/ and are derived from the slug, so
+    the same link always gets the same course id, price and outcome.
+
+    Args:
+        address (tuple): (host, port) to listen on.
+        min_interval (float): Checkouts sooner than this many seconds after
+            the last accepted one are throttled, 0 never throttles.
+        expired_coupons (set): Coupon codes the checkout rejects.
+        latency (float): Seconds added to every response.
+        expired_ratio (float): Share of other coupons that are expired.
+        free_ratio (float): Share of courses that are free.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        min_interval=0,
+        expired_coupons=("EXPIRED",),
+        latency=0,
+        expired_ratio=0,
+        free_ratio=0,
+    ):
+        super().__init__(address, MockUdemyHandler)
+        self.min_interval = min_interval
+        self.expired_coupons = set(expired_coupons)
+        self.latency = latency
+        self.expired_ratio = expired_ratio
+        self.free_ratio = free_ratio
+        self.lock = threading.Lock()
+        self.last_checkout = 0.0
+        self.checkouts = 0
+        self.throttled = 0
+        self.enrolled = {}
+        self.requests = defaultdict(int)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def course_id(self, slug):
+        return str(int(hashlib.sha1(slug.encode()).hexdigest()[:7], 16))
+
+    def is_free(self, course_id):
+        return fraction(f"free|{course_id}") < self.free_ratio
+
+    def coupon_expired(self, course_id, coupon):
+        return (
+            coupon in self.expired_coupons
+            or fraction(f"{course_id}|{coupon}") < self.expired_ratio
+        )
+
+    def price(self, course_id):
+        return f"{10 + int(course_id) % 190}.99"
+
+    def enroll(self, ids):
+        now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        for course_id in ids:
+            self.enrolled.setdefault(course_id, now)
+
+
+class MockUdemyHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real site
+    protocol_version = "HTTP/1.1"
+
+    def send_body(self, status, content_type, data, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, status, body, headers=None):
+        self.send_body(status, "application/json", json.dumps(body).encode(), headers)
+
+    def route(self, endpoint):
+        with self.server.lock:
+            self.server.requests[endpoint] += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = url.path.strip("/").split("/")
+        query = parse_qs(url.query)
+        if path[:2] == ["course", "subscribe"]:
+            self.route("subscribe")
+            self.subscribe(query["courseId"][0])
+        elif path[0] == "course" and len(path) > 1:
+            self.route("landing")
+            self.landing_page(path[1])
+        elif path[:2] == ["api-2.0", "course-landing-components"]:
+            self.route("components")
+            self.landing_components(path[2], query)
+        elif path[:4] == ["api-2.0", "users", "me", "subscribed-courses"]:
+            self.route("subscribed")
+            if len(path) > 4:
+                self.subscribed_course(path[4])
+            else:
+                self.subscribed_courses(query)
+        else:
+            self.send_json(404, {"detail": "Not found."})
+
+    def do_POST(self):
+        if self.path.startswith("/payment/checkout-submit/"):
+            self.route("checkout")
+            self.checkout_submit()
+        else:
+            self.send_json(404, {"detail": "Not found."})
+
+    def landing_page(self, slug):
+        server = self.server
+        course_id = server.course_id(slug)
+        module_args = {
+            "serverSideProps": {
+                "course": {
+                    "id": int(course_id),
+                    "isPaid": not server.is_free(course_id),
+                    "instructors": {
+                        "instructors_info": [
+                            {"absolute_url": "/user/mock-instructor/"}
+                        ]
+                    },
+                    "localeSimpleEnglishTitle": "English",
+                    "rating": 4.5,
+                    "lastUpdateDate": time.strftime("%Y-%m-%d"),
+                },
+                "topicMenu": {"breadcrumbs": [{"title": "Development"}]},
+            }
+        }
+        page = (
+            f"<!DOCTYPE html><html>{LANDING_HEAD}"
+            f'<body class="ud-app-loader" data-clp-course-id="{course_id}" '
+            f'data-module-args="{html.escape(json.dumps(module_args))}">'
+            f"<div>{slug}</div></body></html>"
+        )
+        self.send_body(200, "text/html; charset=utf-8", page.encode())
+
+    def landing_components(self, course_id, query):
+        server = self.server
+        components = query.get("components", [""])[0].split(",")
+        coupon = query.get("couponCode", [None])[0]
+        valid = "redeem_coupon" in components and not server.coupon_expired(
+            course_id, coupon
+        )
+        body = {
+            "purchase": {
+                "data": {
+                    "list_price": {"amount": server.price(course_id)},
+                    "pricing_result": {"discount_percent": 100 if valid else 0},
+                }
+            }
+        }
+        if "redeem_coupon" in components:
+            body["redeem_coupon"] = {
+                "discount_attempts": [
+                    {"code": coupon, "status": "applied" if valid else "expired"}
+                ]
+            }
+        self.send_json(200, body)
+
+    def subscribe(self, course_id):
+        with self.server.lock:
+            self.server.enroll([course_id])
+        self.send_body(200, "text/html", b"<html><body>Subscribed</body></html>")
+
+    def subscribed_course(self, course_id):
+        if course_id in self.server.enrolled:
+            self.send_json(200, {"_class": "course", "id": int(course_id)})
+        else:
+            self.send_json(403, {"detail": "You do not have permission."})
+
+    def subscribed_courses(self, query):
+        page = int(query.get("page", ["1"])[0])
+        page_size = int(query.get("page_size", ["100"])[0])
+        with self.server.lock:
+            enrolled = sorted(
+                self.server.enrolled.items(), key=lambda item: item[1], reverse=True
+            )
+        start = (page - 1) * page_size
+        more = start + page_size < len(enrolled)
+        self.send_json(
+            200,
+            {
+                "count": len(enrolled),
+                "next": self.path.replace(f"page={page}", f"page={page + 1}")
+                if more
+                else None,
+                "results": [
+                    {"_class": "course", "id": int(course_id), "enrollment_time": at}
+                    for course_id, at in enrolled[start : start + page_size]
+                ],
+            },
+        )
+
+    def checkout_submit(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        items = payload["shopping_info"]["items"]
+        server = self.server
+        with server.lock:
+            server.checkouts += 1
+            wait = server.last_checkout + server.min_interval - time.time()
+            if wait > 0:
+                server.throttled += 1
+                self.send_json(
+                    429,
+                    {
+                        "detail": "Request was throttled. Expected available in "
+                        f"{math.ceil(wait)} seconds."
+                    },
+                )
+                return
+            server.last_checkout = time.time()
+            ids = [str(item["buyable"]["id"]) for item in items]
+            # Like Udemy, one bad item fails the whole cart
+            coupons = [item["discountInfo"]["code"] for item in items]
+            if any(map(server.coupon_expired, ids, coupons)):
+                self.send_json(
+                    200, {"status": "failed", "message": "coupon_not_valid"}
+                )
+                return
+            if any(course_id in server.enrolled for course_id in ids):
+                self.send_json(
+                    200, {"status": "failed", "message": "item_already_subscribed"}
+                )
+                return
+            server.enroll(ids)
+        self.send_json(200, {"status": "succeeded"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RewriteAdapter(HTTPAdapter):
+    """
+    Transport adapter that sends every request to `base_url` instead,
+    keeping the path and query. Mount it on a session to point code with
+    hard-coded URLs at a local server.
+    """
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base = urlsplit(base_url)
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = urlunsplit(
+            (self.base.scheme, self.base.netloc, parts.path, parts.query, "")
+        )
+        return super().send(request, **kwargs)
+
+
+def mock_udemy_client(udemy, base_url):
+    """
+    Point a Udemy instance at the mock server, with the default settings
+    and its caches, checkout rate and ledger in a temporary directory.
+    """
+    udemy.client.mount("https://www.udemy.com", RewriteAdapter(base_url))
+    udemy.client.cookies.set("csrftoken", "mock", domain="www.udemy.com")
+    udemy.currency = "eur"
+    udemy.enrolled_courses = {}
+    with open(SETTINGS_PATH) as f:
+        udemy.settings = json.load(f)
+    udemy.settings.update(
+        save_txt=False, discounted_only=False, course_update_threshold_months=24
+    )
+    udemy.is_user_dumb()
+    udemy.initialize_counters()
+    udemy.run = "mock"
+    state_dir = tempfile.mkdtemp()
+    udemy.course_cache = JsonStore(
+        os.path.join(state_dir, "courses.json"), course_cache_ttl
+    )
+    udemy.seen_links = JsonStore(
+        os.path.join(state_dir, "seen.json"), max(seen_outcome_ttl.values())
+    )
+    udemy.checkout_limiter = CheckoutLimiter(
+        os.path.join(state_dir, "checkout-rate.json")
+    )
+    udemy.ledger = Ledger(os.path.join(state_dir, "ledger.db"))
+
+
+def check_cart(server, courses, cart_size):
+    """
+    Push fake validated courses through the checkout queue and compare
+    the counters with what the server recorded.
+    """
+    udemy = Udemy("cli")
+    mock_udemy_client(udemy, server.url)
+    udemy.cart_size = cart_size
+    for index in range(courses):
+        coupon = "EXPIRED" if index % 7 == 6 else "FREE"
+        udemy.handle_discounted_course(
+            {
+                "course_id": str(1000 + index),
+                "coupon_code": coupon,
+                "coupon_valid": True,
+                "amount": Decimal(f"{10 + index * 37 % 190}.99"),
+                "title": f"Course {index}",
+                "link": f"https://www.udemy.com/course/c{index}/?couponCode={coupon}",
+            }
+        )
+    while udemy.checkout_queue:
+        udemy.checkout_next()
+    print()
+    print(f"Checkout requests: {server.checkouts} ({server.throttled} throttled)")
+    print(
+        f"Enrolled: {udemy.successfully_enrolled_c} (server: {len(server.enrolled)})"
+    )
+    assert udemy.successfully_enrolled_c == len(server.enrolled)
+
+
+def main():
+    """
+    Run a local mock of the Udemy enrollment endpoints.
+    """
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument("--port", type=int, default=8770)
+    arg_parser.add_argument(
+        "--min-interval",
+        type=float,
+        default=0,
+        help="Throttle checkouts closer together than this many seconds",
+    )
+    arg_parser.add_argument("--latency", type=float, default=0)
+    arg_parser.add_argument("--expired-ratio", type=float, default=0)
+    arg_parser.add_argument("--free-ratio", type=float, default=0)
+    arg_parser.add_argument(
+        "--check",
+        type=int,
+        metavar="COURSES",
+        help="Check out this many fake courses against the mock and exit",
+    )
+    arg_parser.add_argument("--cart-size", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    server = MockUdemy(
+        ("127.0.0.1", args.port),
+        args.min_interval,
+        latency=args.latency,
+        expired_ratio=args.expired_ratio,
+        free_ratio=args.free_ratio,
+    )
+    if args.check is None:
+        print(f"Mock Udemy on {server.url}")
+        server.serve_forever()
+        return
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        check_cart(server, args.check, args.cart_size)
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
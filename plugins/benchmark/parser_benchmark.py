@@ -0,0 +1,114 @@
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+from bs4 import BeautifulSoup as bs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+
+from base import Scraper, page_strainers, scraper_dict  # noqa: E402
+
+PARSERS = ["html5lib", "html.parser", "lxml"]
+
+
+def record_pages(pages_dir, sites):
+    """
+    Run the scrapers live and save every page they parse.
+    Pages are saved as <site>-<kind>-<n>.html (e.g. du-listing-0.html).
+
+    Args:
+        pages_dir (str): Directory to save the pages in.
+        sites (list): Site names to scrape, as in scraper_dict.
+    """
+    os.makedirs(pages_dir, exist_ok=True)
+    counters = defaultdict(int)
+    scraper = Scraper(sites, use_cache=False)
+    extract = scraper.extract
+
+    def recording_extract(site, kind, content):
+        if content:
+            name = f"{site}-{kind}-{counters[(site, kind)]}.html"
+            counters[(site, kind)] += 1
+            mode = "wb" if isinstance(content, bytes) else "w"
+            with open(os.path.join(pages_dir, name), mode) as f:
+                f.write(content)
+        return extract(site, kind, content)
+
+    scraper.extract = recording_extract
+    for site in sites:
+        getattr(scraper, scraper_dict[site])()
+        print(f"{site}: {len(getattr(scraper, scraper_dict[site] + '_data'))} links")
+    scraper.close()
+
+
+def load_pages(pages_dir):
+    """
+    Load saved pages grouped by site and page kind.
+
+    Args:
+        pages_dir (str): Directory holding <site>-<kind>-<n>.html files.
+
+    Returns:
+        dict: {(site, kind): [page bytes, ...]}
+    """
+    pages = defaultdict(list)
+    for name in sorted(os.listdir(pages_dir)):
+        site, kind, _ = name.split("-", 2)
+        if site in page_strainers and kind in page_strainers[site]:
+            with open(os.path.join(pages_dir, name), "rb") as f:
+                pages[(site, kind)].append(f.read())
+    return pages
+
+
+def time_parser(pages, parser, parse_only, repeat):
+    """
+    Time parsing a list of pages.
+
+    Returns:
+        float: Best total CPU time in milliseconds over `repeat` runs.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.process_time()
+        for page in pages:
+            bs(page, parser, parse_only=parse_only)
+        best = min(best, time.process_time() - start)
+    return best * 1000
+
+
+def main():
+    """
+    Compare parser backends, with and without selective parsing, per site.
+    """
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument("pages_dir", help="Directory with saved pages")
+    arg_parser.add_argument(
+        "--record",
+        action="store_true",
+        help="Scrape the live sites and save their pages first",
+    )
+    arg_parser.add_argument(
+        "--sites", nargs="*", default=list(scraper_dict), help="Sites to record"
+    )
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    if args.record:
+        record_pages(args.pages_dir, args.sites)
+
+    pages = load_pages(args.pages_dir)
+    header = f"{'page':<16}{'n':>4}" + "".join(f"{p:>14}" for p in PARSERS)
+    print(header + f"{'lxml+strainer':>16}")
+    for (site, kind), site_pages in sorted(pages.items()):
+        row = f"{site + '-' + kind:<16}{len(site_pages):>4}"
+        for parser in PARSERS:
+            row += f"{time_parser(site_pages, parser, None, args.repeat):>12.1f}ms"
+        strainer = page_strainers[site][kind]
+        row += f"{time_parser(site_pages, 'lxml', strainer, args.repeat):>14.1f}ms"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+
+from base import Scraper, scraper_dict  # noqa: E402
+
+# Response headers worth replaying, the rest depend on the live server
+KEPT_HEADERS = ("Content-Type", "Location")
+
+
+class Fixtures:
+    """
+    Recorded responses, stored as one file per body plus an index.json
+    mapping "<METHOD> <url>" to the status, headers and body file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(os.path.join(path, "index.json")) as f:
+                self.index = json.load(f)
+        except FileNotFoundError:
+            self.index = {}
+
+    def save(self, method, url, r):
+        key = f"{method} {url}"
+        name = hashlib.sha1(key.encode()).hexdigest()
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, name), "wb") as f:
+            f.write(r.content)
+        with self.lock:
+            self.index[key] = {
+                "status": r.status_code,
+                "headers": {h: r.headers[h] for h in KEPT_HEADERS if h in r.headers},
+                "body": name,
+            }
+
+    def get(self, method, url):
+        """
+        Returns:
+            tuple: (status, headers, body), None if it was never recorded.
+        """
+        entry = self.index.get(f"{method} {url}")
+        if entry is None:
+            return None
+        with open(os.path.join(self.path, entry["body"]), "rb") as f:
+            return entry["status"], entry["headers"], f.read()
+
+    def dump(self):
+        with open(os.path.join(self.path, "index.json"), "w") as f:
+            json.dump(self.index, f, indent=1)
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    Transport adapter that saves every response it carries, redirects
+    included, to the fixtures.
+    """
+
+    def __init__(self, fixtures, **kwargs):
+        super().__init__(**kwargs)
+        self.fixtures = fixtures
+
+    def send(self, request, **kwargs):
+        r = super().send(request, **kwargs)
+        self.fixtures.save(request.method, request.url, r)
+        return r
+
+
+class ReplayAdapter(HTTPAdapter):
+    """
+    Transport adapter that sends every request to the stand-in server as
+    <base_url>/<scheme>/<host><path>. Responses keep the original URL, so
+    redirects and code reading `r.url` behave as they do live.
+    """
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    def send(self, request, **kwargs):
+        url = request.url
+        parts = urlsplit(url)
+        request.url = f"{self.base_url}/{parts.scheme}/{parts.netloc}{parts.path or '/'}"
+        if parts.query:
+            request.url += f"?{parts.query}"
+        r = super().send(request, **kwargs)
+        r.url = request.url = url
+        return r
+
+
+class StandIn(ThreadingHTTPServer):
+    """
+    Local HTTP server replaying the fixtures, with optional latency and
+    injected failures.
+
+    Args:
+        latency (float): Seconds added to every response.
+        jitter (float): Up to this many more seconds, at random.
+        error_rate (float): Share of requests answered with a 503.
+        drop_rate (float): Share of connections closed without an answer.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, fixtures, latency=0, jitter=0, error_rate=0, drop_rate=0):
+        super().__init__(address, StandInHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(0)
+        self.lock = threading.Lock()
+        self.counts = {"served": 0, "missing": 0, "errors": 0, "dropped": 0}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on kept-alive connections when their run ends
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real sites
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.replay("GET")
+
+    def do_POST(self):
+        self.replay("POST")
+
+    def replay(self, method):
+        server = self.server
+        if length := int(self.headers.get("Content-Length") or 0):
+            self.rfile.read(length)
+        scheme, _, rest = self.path.lstrip("/").partition("/")
+        url = f"{scheme}://{rest}"
+        with server.lock:
+            delay = server.latency + server.random.uniform(0, server.jitter)
+            roll = server.random.random()
+        time.sleep(delay)
+        if roll < server.drop_rate:
+            server.count("dropped")
+            self.close_connection = True
+            return
+        if roll < server.drop_rate + server.error_rate:
+            server.count("errors")
+            self.send_body(503, {"Content-Type": "text/plain"}, b"Injected error")
+            return
+        fixture = server.fixtures.get(method, url)
+        if fixture is None:
+            server.count("missing")
+            self.send_body(404, {"Content-Type": "text/plain"}, b"Not recorded")
+            return
+        server.count("served")
+        self.send_body(*fixture)
+
+    def send_body(self, status, headers, body):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def record(fixtures_dir, sites):
+    """
+    Scrape the live sites once, saving every response as a fixture.
+    """
+    fixtures = Fixtures(fixtures_dir)
+    scraper = Scraper(sites, use_cache=False)
+    scraper.sessions.adapter_factory = partial(RecordingAdapter, fixtures)
+    for site in sites:
+        scraper.run_site(site)
+        code = scraper_dict[site]
+        print(f"{site}: {len(getattr(scraper, code + '_data'))} links")
+    scraper.close()
+    fixtures.dump()
+    print(f"{len(fixtures.index)} responses saved to {fixtures_dir}")
+
+
+def replay(sites, base_url, parse_processes, results):
+    """
+    Run the scrapers against the stand-in, all sites at once like a real
+    run. Runs in its own process so peak RSS is its own.
+    """
+    scraper = Scraper(sites, use_cache=False, parse_processes=parse_processes)
+    scraper.sessions.adapter_factory = partial(ReplayAdapter, base_url)
+    threads = [threading.Thread(target=scraper.run_site, args=(site,)) for site in sites]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    report = {"elapsed": elapsed, "peak_rss": peak_rss_mb(), "sites": {}}
+    for site in sites:
+        code = scraper_dict[site]
+        report["sites"][site] = {
+            **scraper.metrics[code].as_dict(),
+            "failed": bool(getattr(scraper, code + "_error")),
+        }
+    scraper.close()
+    results.put(report)
+
+
+def run_replay(sites, base_url, parse_processes):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(
+        target=replay, args=(sites, base_url, parse_processes, results)
+    )
+    process.start()
+    report = results.get()
+    process.join()
+    return report
+
+
+def row(name, requests, retries, elapsed, parse_time, peak_rss, links, failed):
+    rss = "n/a" if peak_rss is None else f"{peak_rss:.0f}MB"
+    return (
+        f"{name:<18}{requests:>6}{retries:>8}{requests / elapsed:>10.1f}"
+        f"{parse_time * 1000:>10.0f}ms{elapsed:>9.2f}s{rss:>9}{links:>7}"
+        f"{'  FAILED' if failed else ''}"
+    )
+
+
+def main():
+    """
+    Benchmark every scraper offline against recorded pages.
+    """
+    arg_parser = argparse.ArgumentParser(description=main.__doc__)
+    arg_parser.add_argument(
+        "fixtures_dir",
+        help="Directory with recorded responses. None ship with the repo, "
+        "the first run needs --record and network access",
+    )
+    arg_parser.add_argument(
+        "--record",
+        action="store_true",
+        help="Scrape the live sites and record their responses first",
+    )
+    arg_parser.add_argument(
+        "--sites", nargs="*", default=list(scraper_dict), help="Sites to run"
+    )
+    arg_parser.add_argument("--latency", type=float, default=0.05)
+    arg_parser.add_argument("--jitter", type=float, default=0.02)
+    arg_parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0,
+        help="Share of requests answered with a 503. Pages are retried, but "
+        "redirect lookups and API calls are not and fail their item or site",
+    )
+    arg_parser.add_argument(
+        "--drop-rate",
+        type=float,
+        default=0,
+        help="Share of connections closed without an answer, not retried",
+    )
+    arg_parser.add_argument("--parse-processes", type=int, default=0)
+    arg_parser.add_argument("--json", help="Also save the results to this file")
+    args = arg_parser.parse_args()
+
+    if args.record:
+        record(args.fixtures_dir, args.sites)
+
+    server = StandIn(
+        ("127.0.0.1", 0),
+        Fixtures(args.fixtures_dir),
+        args.latency,
+        args.jitter,
+        args.error_rate,
+        args.drop_rate,
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = {}
+    print(
+        f"{'site':<18}{'pages':>6}{'retries':>8}{'pages/s':>10}{'parse':>12}{'total':>10}"
+        f"{'peak RSS':>9}{'links':>7}"
+    )
+    try:
+        # Each site alone, then all of them together as in a real run
+        for site in args.sites:
+            report = run_replay([site], server.url, args.parse_processes)
+            metrics = report["sites"][site]
+            results[site] = {**report, "sites": None, **metrics}
+            print(
+                row(
+                    site,
+                    metrics["requests"],
+                    metrics["retries"],
+                    report["elapsed"],
+                    metrics["parse_time"],
+                    report["peak_rss"],
+                    metrics["links"],
+                    metrics["failed"],
+                )
+            )
+        report = run_replay(args.sites, server.url, args.parse_processes)
+        sites = report["sites"].values()
+        results["all"] = report
+        print(
+            row(
+                "all",
+                sum(m["requests"] for m in sites),
+                sum(m["retries"] for m in sites),
+                report["elapsed"],
+                sum(m["parse_time"] for m in sites),
+                report["peak_rss"],
+                sum(m["links"] for m in sites),
+                any(m["failed"] for m in sites),
+            )
+        )
+    finally:
+        server.shutdown()
+    print(", ".join(f"{name}: {count}" for name, count in server.counts.items()))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()